@@ -0,0 +1,127 @@
+import math
+
+import numpy as np
+import torch
+from torch import nn
+
+try:
+    from agents.nfLayers.proper import AugmentedLagrangian
+except:
+    from nfLayers.proper import AugmentedLagrangian
+
+
+ACYCLICITY_METHODS = ('expm', 'series')
+
+
+def _trace(M):
+    return M.diagonal(dim1=-2, dim2=-1).sum(-1)
+
+
+def trace_expm(M):
+    """tr(exp(M)) for a batch (..., n, n), exact."""
+    return _trace(torch.linalg.matrix_exp(M))
+
+
+def trace_series(M, order):
+    """tr(exp(M)) - n truncated after the `order`-th power,
+    sum_{k=1..order} tr(M^k) / k!.
+
+    Only the powers up to h = ceil(order / 2) are formed (h - 1 batched
+    matmuls). A higher trace is an elementwise product,
+    tr(M^(h+a)) = sum(M^h * (M^a)^T). The powers are kept as M^k / k!,
+    so they stay bounded for large n.
+    """
+    half = (order + 1) // 2
+    powers = [M] # powers[k - 1] = M^k / k!
+    for k in range(2, half + 1):
+        powers.append(torch.matmul(powers[-1], M) / k)
+    total = 0.
+    for k in range(1, order + 1):
+        if k <= half:
+            total = total + _trace(powers[k - 1])
+        else:
+            a = k - half
+            cross = (powers[half - 1] * powers[a - 1].transpose(-2, -1)).sum((-2, -1))
+            total = total + cross / math.comb(k, half)
+    return total
+
+
+def acyclicity(As, method='expm', order=None, ignore_self_loops=True):
+    """NOTEARS acyclicity h(A) = tr(exp(A * A)) - n of a batch of graphs.
+
+    h(A) is non-negative, and zero exactly when A has no directed cycle.
+
+    Args:
+        As: (..., n, n) adjacency tensor.
+        method (`str`): 'expm' (exact, matrix exponential) or 'series'
+            (power series truncated at `order`; it only sees cycles of
+            length <= `order`, and is exact on 0/1 graphs for order >= n).
+        order (`int`): Order of the series, n by default.
+        ignore_self_loops (`bool`): Drop the diagonal first. An agent
+            aggregating its own state is not a communication cycle.
+
+    Returns:
+        Tensor of shape As.shape[:-2].
+    """
+    n = As.shape[-1]
+    M = As * As
+    if ignore_self_loops:
+        M = M * (1. - torch.eye(n, dtype=M.dtype, device=M.device))
+    if method == 'expm':
+        return trace_expm(M) - n
+    if method == 'series':
+        return trace_series(M, n if order is None else order)
+    raise ValueError('Unknown acyclicity method: {}'.format(method))
+
+
+class AcyclicityConstraint(nn.Module):
+    """Acyclicity penalty under an augmented-Lagrangian schedule.
+
+    `forward` turns a cost (e.g. the expected h(A) of a batch) into
+    lam * cost + rho / 2 * cost^2 through `AugmentedLagrangian`. `step` is
+    called after every backward pass. Every `step_interval` calls it
+    raises lam by rho times the mean constraint violation h of the
+    interval, as NOTEARS does. rho is only multiplied by `beta` when h has
+    not dropped below `progress` times its value at the previous step, and
+    never beyond `rho_max`, so the quadratic term cannot blow up over a
+    long run.
+    """
+
+    def __init__(self, method='expm', order=None, ignore_self_loops=True,
+                 rho=1., lam=1., beta=2, thr=1, step_interval=100, rho_max=1e6, progress=0.25):
+        super(AcyclicityConstraint, self).__init__()
+        if method not in ACYCLICITY_METHODS:
+            raise ValueError('Unknown acyclicity method: {}'.format(method))
+        self.method = method
+        self.order = order
+        self.ignore_self_loops = ignore_self_loops
+        self.step_interval = step_interval
+        self.rho_max = rho_max
+        self.progress = progress
+        self.n_steps = 0
+        self.last_h = None
+        self.lagrangian = AugmentedLagrangian(min(rho, rho_max), lam, beta=beta, thr=thr)
+
+    def h(self, As):
+        return acyclicity(As, self.method, self.order, self.ignore_self_loops)
+
+    def forward(self, cost):
+        return self.lagrangian(cost).squeeze(0)
+
+    def step(self):
+        self.n_steps += 1
+        lagrangian = self.lagrangian
+        if self.n_steps % self.step_interval != 0 or lagrangian.backward_count == 0:
+            return
+        h = abs(lagrangian.cumulated_grad_lambda / lagrangian.backward_count)
+        if not np.isfinite(h):
+            h = lagrangian.thr.item()
+        if self.last_h is not None and h > self.progress * self.last_h:
+            lagrangian.rho.data = torch.clamp(lagrangian.rho.data * lagrangian.beta, max=self.rho_max)
+        lagrangian.lam.data += lagrangian.rho.data * min(h, lagrangian.thr.item())
+        self.last_h = h
+
+        lagrangian.backward_count = 0
+        lagrangian.cumulated_grad_lambda = 0
+        lagrangian.raw_cost = 0
+        lagrangian.zero_grad()
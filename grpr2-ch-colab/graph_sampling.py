@@ -0,0 +1,73 @@
+import torch
+
+
+ENTROPY_ESTIMATORS = ('analytic', 'mc', 'off')
+
+
+def sample_gumbel(shape, out=None):
+    # computed in place, so a preallocated `out` buffer is reused as is
+    unif = torch.rand(shape, out=out)
+    return unif.clamp_(min=1e-20, max=1. - 1e-7).log_().neg_().log_().neg_()
+
+
+def sample_graphs(base_logits, batch_size, noise=None):
+    """Draw `batch_size` flattened graphs from the factorized base distribution.
+
+    `base_logits` holds one row of category logits per adjacency entry,
+    shape (n * n, vocab_size). A single Gumbel-max draw over a
+    (batch_size, n * n, vocab_size) noise tensor samples every entry of
+    every graph at once. `noise` is an optional buffer for that tensor.
+
+    Returns:
+        Long tensor of shape (batch_size, n * n) with the sampled categories.
+    """
+    log_pi = torch.log_softmax(base_logits, dim=-1)
+    g = sample_gumbel((batch_size,) + tuple(log_pi.shape), out=noise)
+    return torch.argmax(log_pi + g, dim=-1)
+
+
+def graph_log_prob(base_logits, graphs):
+    """Log-probability of flattened graphs (batch, n * n) under the base."""
+    log_pi = torch.log_softmax(base_logits, dim=-1)
+    one_hot = torch.nn.functional.one_hot(graphs.long(), num_classes=log_pi.shape[-1]).type(log_pi.dtype)
+    return torch.sum(one_hot * log_pi, dim=(-2, -1))
+
+
+def analytic_entropy(base_logits):
+    """Exact entropy of the factorized categorical base distribution:
+    the sum of the per-entry categorical entropies."""
+    log_pi = torch.log_softmax(base_logits, dim=-1)
+    return -torch.sum(log_pi.exp() * log_pi)
+
+
+def mc_entropy(base_logits, num_samples):
+    """Monte Carlo entropy estimate from `num_samples` graphs.
+
+    The value is -mean(log p(A)). Its gradient is the score-function
+    estimate of the entropy gradient, since the samples themselves are not
+    differentiable.
+    """
+    with torch.no_grad():
+        graphs = sample_graphs(base_logits, num_samples)
+    log_p = graph_log_prob(base_logits, graphs)
+    surrogate = -(log_p.detach() * log_p).mean()
+    return -log_p.detach().mean() + (surrogate - surrogate.detach())
+
+
+def base_entropy(base_logits, estimator='analytic', num_samples=1):
+    """Entropy of the graph base distribution with the chosen estimator.
+
+    Args:
+        estimator (`str`): 'analytic' (exact, closed form), 'mc' (Monte Carlo
+            over `num_samples` graphs) or 'off'.
+
+    Returns:
+        Scalar tensor, or None if `estimator` is 'off'.
+    """
+    if estimator == 'analytic':
+        return analytic_entropy(base_logits)
+    if estimator == 'mc':
+        return mc_entropy(base_logits, num_samples)
+    if estimator == 'off':
+        return None
+    raise ValueError('Unknown entropy estimator: {}'.format(estimator))
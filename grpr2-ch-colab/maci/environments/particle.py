@@ -3,6 +3,7 @@ from gym import spaces
 from gym.envs.registration import EnvSpec
 import numpy as np
 from multiagent.multi_discrete import MultiDiscrete
+from multiagent.core import VecWorld
 from maci.misc.space import MADiscrete, MABox
 from maci.environments.env_spec import MAEnvSpec
 import maci.envs.mpe_scenarios as new_scenarios
@@ -10,15 +11,24 @@ import maci.envs.mpe_scenarios as new_scenarios
 # environment for all agents in the multiagent world
 # currently code assumes that no agents will be created/destroyed at runtime!
 
-def make_particle_env(game_name, benchmark=False):
+def make_particle_env(game_name, benchmark=False, vectorized=False):
     scenario = new_scenarios.load(game_name + ".py").Scenario()
     # create world
-    world = scenario.make_world()
+    if vectorized:
+        # array-backed physics (multiagent.core.VecWorld)
+        world = scenario.make_world(vectorized=True)
+    else:
+        world = scenario.make_world()
     # create multiagent environment
+    # batched reward/observation kernels, if the scenario provides them
+    rewards_all = getattr(scenario, 'rewards_all', None)
+    observations_all = getattr(scenario, 'observations_all', None)
     if benchmark:
-        env = ParticleEnv(world, scenario.reset_world, scenario.reward, scenario.observation, scenario.benchmark_data)
+        env = ParticleEnv(world, scenario.reset_world, scenario.reward, scenario.observation, scenario.benchmark_data,
+                          rewards_all_callback=rewards_all, observations_all_callback=observations_all)
     else:
-        env = ParticleEnv(world, scenario.reset_world, scenario.reward, scenario.observation)
+        env = ParticleEnv(world, scenario.reset_world, scenario.reward, scenario.observation,
+                          rewards_all_callback=rewards_all, observations_all_callback=observations_all)
     return env
 # environment for all agents in the multiagent world
 # currently code assumes that no agents will be created/destroyed at runtime!
@@ -32,7 +42,8 @@ class ParticleEnv(gym.Env):
 
     def __init__(self, world, reset_callback=None, reward_callback=None,
                  observation_callback=None, info_callback=None,
-                 done_callback=None, shared_viewer=True):
+                 done_callback=None, shared_viewer=True,
+                 rewards_all_callback=None, observations_all_callback=None):
 
         self.world = world
         self.agents = self.world.policy_agents
@@ -44,6 +55,8 @@ class ParticleEnv(gym.Env):
         self.observation_callback = observation_callback
         self.info_callback = info_callback
         self.done_callback = done_callback
+        self.rewards_all_callback = rewards_all_callback
+        self.observations_all_callback = observations_all_callback
         # environment parameters
         self.discrete_action_space = True
         # if true, action is a number 0...N, otherwise action is a one-hot N-dimensional vector
@@ -117,21 +130,39 @@ class ParticleEnv(gym.Env):
         self._reset_render()
 
     def step(self, action_n):
-        obs_n = []
-        reward_n = []
-        done_n = []
-        info_n = {'n': []}
+        self._set_actions(action_n)
+        # advance world state
+        self.world.step()
+        return self._collect_step()
+
+    # step several environments; worlds backed by VecWorld advance in one batched call
+    @staticmethod
+    def step_batch(envs, action_n_list):
+        if not all(isinstance(env.world, VecWorld) for env in envs):
+            return [env.step(action_n) for env, action_n in zip(envs, action_n_list)]
+        for env, action_n in zip(envs, action_n_list):
+            env._set_actions(action_n)
+        VecWorld.step_worlds([env.world for env in envs])
+        return [env._collect_step() for env in envs]
+
+    def _set_actions(self, action_n):
         self.agents = self.world.policy_agents
         # set action for each agent
         for i, agent in enumerate(self.agents):
             # print(action_n[i], agent, self.action_space[i])
             self._set_action(action_n[i], agent, self.action_space[i])
-        # advance world state
-        self.world.step()
+
+    def _collect_step(self):
+        obs_n = []
+        reward_n = []
+        done_n = []
+        info_n = {'n': []}
+        obs_all = self._get_obs_all()
+        reward_all = self._get_reward_all()
         # record observation for each agent
-        for agent in self.agents:
-            obs_n.append(self._get_obs(agent))
-            reward_n.append(self._get_reward(agent))
+        for i, agent in enumerate(self.agents):
+            obs_n.append(self._get_obs(agent) if obs_all is None else obs_all[i])
+            reward_n.append(self._get_reward(agent) if reward_all is None else reward_all[i])
             done_n.append(self._get_done(agent))
 
             info_n['n'].append(self._get_info(agent))
@@ -146,11 +177,16 @@ class ParticleEnv(gym.Env):
     def reset(self):
         # reset world
         self.reset_callback(self.world)
+        if isinstance(self.world, VecWorld):
+            self.world.reset_state()
         # reset renderer
         self._reset_render()
         # record observations for each agent
-        obs_n = []
         self.agents = self.world.policy_agents
+        obs_all = self._get_obs_all()
+        if obs_all is not None:
+            return list(obs_all)
+        obs_n = []
         for agent in self.agents:
             obs_n.append(self._get_obs(agent))
         return obs_n
@@ -170,6 +206,22 @@ class ParticleEnv(gym.Env):
             return np.zeros(0)
         return self.observation_callback(agent, self.world)
 
+    # batched kernels cover world.agents, so only use them when no agent is scripted
+    def _batched_callbacks_valid(self):
+        return len(self.agents) == len(self.world.agents)
+
+    # get observations for all agents at once (None if unavailable)
+    def _get_obs_all(self):
+        if self.observations_all_callback is None or not self._batched_callbacks_valid():
+            return None
+        return self.observations_all_callback(self.world)
+
+    # get rewards for all agents at once (None if unavailable)
+    def _get_reward_all(self):
+        if self.rewards_all_callback is None or not self._batched_callbacks_valid():
+            return None
+        return self.rewards_all_callback(self.world)
+
     # get dones for a particular agent
     # unused right now -- agents are allowed to go beyond the viewing screen
     def _get_done(self, agent):
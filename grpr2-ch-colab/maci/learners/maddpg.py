@@ -88,6 +88,9 @@ class MADDPG(MARLAlgorithm):
 
         self._training_ops = []
         self._target_ops = []
+        # (target, source) variables of the soft update, in matching order
+        self._target_params = []
+        self._source_params = []
 
         self._create_q_update()
         self._create_p_update()
@@ -231,6 +234,8 @@ class MADDPG(MARLAlgorithm):
                         var_list=self.policy.get_params_internal())
                     self._training_ops.append(pg_training_op)
         self._pg_loss = pg_loss
+        # Q-mean diagnostic, built once so `ret_q_mean` does not add ops to the graph
+        self._q_mean = tf.stop_gradient(pg_loss, name='q_mean_agent_{}'.format(self._agent_id))
 
     def _create_target_ops(self):
         """Create tensorflow operation for updating the target functions."""
@@ -242,13 +247,14 @@ class MADDPG(MARLAlgorithm):
         source_p_params = self._policy.get_params_internal()
         target_p_params = self._target_policy.get_params_internal()
 
+        self._target_params = target_q_params + target_p_params
+        self._source_params = source_q_params + source_p_params
+
+        # one fused soft update of the Q-function and policy per agent
         self._target_ops = [
-                               tf.compat.v1.assign(target, (1 - self._tau) * target + self._tau * source)
-                               for target, source in zip(target_q_params, source_q_params)
-                           ] + [
-                               tf.compat.v1.assign(target, (1 - self._tau) * target + self._tau * source)
-                               for target, source in zip(target_p_params, source_p_params)
-                           ]
+            tf_utils.polyak_update(self._target_params, self._source_params,
+                                   self._tau, name='target_update_agent_{}'.format(self._agent_id))
+        ]
 
     # TODO: do not pass, policy, and pool to `__init__` directly.
     def train(self):
@@ -334,6 +340,6 @@ class MADDPG(MARLAlgorithm):
         """
 
         feeds = self._get_feed_dict(batch)
-        qf = self._sess.run(tf.stop_gradient(self._pg_loss), feeds)
+        qf = self._sess.run(self._q_mean, feeds)
 
         return qf
\ No newline at end of file
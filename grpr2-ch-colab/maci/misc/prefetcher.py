@@ -0,0 +1,99 @@
+import queue
+import threading
+
+import numpy as np
+
+
+def _others(arrays, i):
+    # the arrays of every agent but i, side by side
+    return np.concatenate(arrays[:i] + arrays[i + 1:], axis=-1)
+
+
+def make_batch_n(agents, batch_size, shared_pool=None, rng=np.random):
+    """Sample the NumPy side of one team update.
+
+    All agents are sampled at the same random indices. Each batch also gets
+    its opponent-action view and, for opponent-modelling agents, the views
+    over the `batch_size` most recent transitions.
+
+    Returns:
+        The per-agent batches and a dict with the graph-update arrays (`obs`,
+        `As`, `log_As_probs` and, if the pools store it, `full_obs`, as
+        taken by `GraphFlows.backward`).
+    """
+    pool = shared_pool if shared_pool is not None else agents[0].pool
+    indices = rng.randint(0, pool.size, batch_size)
+    recent_indices = np.arange(pool._top - batch_size, pool._top)
+    if shared_pool is not None:
+        batch_n = shared_pool.batch_n_by_indices(indices)
+        recent_batch_n = shared_pool.batch_n_by_indices(recent_indices)
+    else:
+        batch_n = [agent.pool.random_batch_by_indices(indices) for agent in agents]
+        recent_batch_n = [agent.pool.random_batch_by_indices(recent_indices) for agent in agents]
+
+    actions_n = [batch['actions'] for batch in batch_n]
+    recent_actions_n = [batch['actions'] for batch in recent_batch_n]
+    for i, (agent, batch) in enumerate(zip(agents, batch_n)):
+        batch['opponent_actions'] = _others(actions_n, i)
+        if agent.joint and agent.opponent_modelling:
+            batch['recent_opponent_observations'] = recent_batch_n[i]['observations']
+            batch['recent_opponent_actions'] = _others(recent_actions_n, i)
+
+    # the graph and its log-prob are joint, the same in every agent's batch
+    graph_batch = dict(obs=np.concatenate([batch['observations'] for batch in batch_n], axis=-1),
+                       As=np.array(batch_n[0]['adj_mats']),
+                       log_As_probs=np.array(batch_n[0]['log_adj_mats']))
+    if 'full_obs' in batch_n[0]:
+        graph_batch['full_obs'] = batch_n[0]['full_obs']
+    return batch_n, graph_batch
+
+
+class BatchPrefetcher(object):
+    """Builds the next `depth` team batches (`make_batch_n`) on a worker thread.
+
+    The training loop only takes finished batches from a bounded queue, so
+    the replay gathers and opponent views overlap with the TF updates.
+    Batches are prepared up to `depth` sampler steps ahead. Replay writes
+    must hold `lock` (see `GrMASampler.set_pool_lock`), so a gather never
+    reads a transition that is only partly written.
+    """
+
+    def __init__(self, agents, batch_size, shared_pool=None, depth=2):
+        self.agents = agents
+        self.batch_size = batch_size
+        self.shared_pool = shared_pool
+        self.lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=depth)
+        self._rng = np.random.RandomState(np.random.randint(2 ** 31))
+        self._stop = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='batch_prefetcher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                with self.lock:
+                    item = make_batch_n(self.agents, self.batch_size, self.shared_pool, self._rng)
+                while not self._stop.is_set():
+                    try:
+                        self._queue.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+        except Exception as e:
+            self._error = e
+
+    def get(self):
+        """Next prepared `(batch_n, graph_batch)`."""
+        while True:
+            if self._error is not None:
+                raise RuntimeError('batch prefetcher thread failed') from self._error
+            try:
+                return self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
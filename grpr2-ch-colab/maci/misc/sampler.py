@@ -1,5 +1,6 @@
 import numpy as np
 import time
+from contextlib import nullcontext
 
 from maci.misc import logger
 from copy import deepcopy
@@ -157,11 +158,24 @@ class SimpleSampler(Sampler):
 
 
 class GrMASampler(SimpleSampler):
-    def __init__(self, agent_num, joint, graph_policy, **kwargs):
+    def __init__(self, agent_num, joint, graph_policy, reuse_next_graph=False, **kwargs):
+        """
+        Args:
+            reuse_next_graph (`bool`): Carry the adjacency matrix, log-prob and
+                message sampled for the next observation over as the current
+                ones of the following step, instead of running the graph
+                policy on that observation again. The next message is then
+                built from the next hidden state, so a stored transition's
+                next observation is exactly the following one's observation.
+                The carried graph is dropped on reset and by
+                `invalidate_graph_cache`.
+        """
         super(SimpleSampler, self).__init__(**kwargs)
         self.agent_num = agent_num
         self.graph_policy = graph_policy
         self.joint = joint
+        self._reuse_next_graph = reuse_next_graph
+        self._next_graph = None
         self._path_length = 0
         self._path_return = np.array([0.] * self.agent_num, dtype=np.float32)
         self._last_path_return = np.array([0.] * self.agent_num, dtype=np.float32)
@@ -172,6 +186,8 @@ class GrMASampler(SimpleSampler):
         self._current_observation_n = None
         self.env = None
         self.agents = None
+        self.actors = None
+        self.pool_lock = nullcontext()
         self.next_obs_messg_list = None
         
         self.matrix_A_list = [] 
@@ -183,6 +199,26 @@ class GrMASampler(SimpleSampler):
         for agent, policy in zip(self.agents, policies):
             agent.policy = policy
 
+    def set_actors(self, actors):
+        # act through these instead of the agents' policies, e.g. the NumPy
+        # mirrors of `NumpyActorEngine.actors`; None restores the policies
+        self.actors = actors
+
+    def set_pool_lock(self, lock):
+        # held around the replay writes only, e.g. the lock of a
+        # `BatchPrefetcher` gathering from the same pools
+        self.pool_lock = nullcontext() if lock is None else lock
+
+    def _actor(self, i):
+        return self.agents[i].policy if self.actors is None else self.actors[i]
+
+    def _reset_noise(self, env_ids=None):
+        # restart the exploration noise of the environments whose episode ended
+        for i in range(self.agent_num):
+            reset_noise = getattr(self._actor(i), 'reset_noise', None)
+            if reset_noise is not None:
+                reset_noise(env_ids)
+
     def batch_ready(self):
         enough_samples = self.agents[0].pool.size >= self._min_pool_size
         return enough_samples
@@ -190,10 +226,23 @@ class GrMASampler(SimpleSampler):
     def random_batch(self, i):
         return self.agents[i].pool.random_batch(self._batch_size)
 
-    def initialize(self, env, agents):
+    def _act_graph(self, full_obs, hidden_state):
+        # single-observation graph, log-prob and messages from the inference path
+        matrix_A, log_matrix_A_probs, messg_split = self.graph_policy.act(full_obs[None], hidden_state[None])
+        return matrix_A[0], log_matrix_A_probs, messg_split[0]
+
+    def invalidate_graph_cache(self):
+        # called when the graph policy changes, so that a graph sampled by
+        # the old policy is not reused with its stale log-prob
+        self._next_graph = None
+
+    def initialize(self, env, agents, pool=None):
+        # pool: optional MultiAgentReplayBuffer shared by all agents; when set,
+        # transitions are written once to it instead of to every agent's pool
         self._current_observation_n = None
         self.env = env
         self.agents = agents
+        self.pool = pool
 
     def sample(self):
         if self._current_observation_n is None:
@@ -211,19 +260,18 @@ class GrMASampler(SimpleSampler):
                 full_obs = np.hstack((full_obs, self._current_observation_n[i]))
                 
         self.full_obs_list.append(full_obs)
-        matrix_A, log_matrix_A_probs = self.graph_policy.forward([full_obs])
-        self.matrix_A_list.append(matrix_A.detach().numpy())
-        self.log_matrix_A_probs_list.append(log_matrix_A_probs.detach().numpy())
-        
-        self.torch_hidden_state = torch.tensor(full_obs, dtype=torch.float32, device= 'cpu').reshape((self.agent_num, self.agents[0]._observation_dim))
-        # print(matrix_A)
-        # print(self.torch_hidden_state)
-        messg_split = torch.matmul(matrix_A, self.torch_hidden_state).squeeze()
+        self.hidden_state = np.reshape(full_obs, (self.agent_num, self.agents[0]._observation_dim))
+        if self._reuse_next_graph and self._next_graph is not None:
+            matrix_A, log_matrix_A_probs, messg_split = self._next_graph
+        else:
+            matrix_A, log_matrix_A_probs, messg_split = self._act_graph(full_obs, self.hidden_state)
+        self.matrix_A_list.append(matrix_A)
+        self.log_matrix_A_probs_list.append(log_matrix_A_probs)
         
         obs_messg = []
         for i in range(self.agent_num):
            messg_i = messg_split[i]
-           obs_messg.append(np.concatenate([messg_i.detach().numpy()]))
+           obs_messg.append(np.concatenate([messg_i]))
 
         self.obs_messg_list.append(obs_messg)
 
@@ -240,8 +288,8 @@ class GrMASampler(SimpleSampler):
         
         action_n = []
         # for agent, current_observation in zip(self.agents, self._current_observation_n):
-        for agent, current_observation in zip(self.agents, messg_split):
-            action, _ = agent.policy.get_action(current_observation.detach().numpy())
+        for i, (agent, current_observation) in enumerate(zip(self.agents, messg_split)):
+            action, _ = self._actor(i).get_action(current_observation)
             if agent.joint_policy:
                 action_n.append(np.array(action)[0:agent._action_dim])
             else:
@@ -252,7 +300,9 @@ class GrMASampler(SimpleSampler):
         self._total_samples += 1
         
         self.next_obs_messg_list = []
-        self.next_torch_hidden_state = self.torch_hidden_state
+        self.next_hidden_state = self.hidden_state
+        if self._reuse_next_graph:
+            self.next_hidden_state = np.reshape(np.hstack(next_observation_n), (self.agent_num, self.agents[0]._observation_dim))
         
         for i in range(self.agent_num):
             if i == 0:
@@ -260,42 +310,57 @@ class GrMASampler(SimpleSampler):
             else:
                 next_full_obs        = np.hstack((next_full_obs, next_observation_n[i]))
 
-        next_matrix_A, next_log_matrix_A_probs = self.graph_policy.forward([next_full_obs])
-
-        next_messg_split = torch.matmul(next_matrix_A, self.next_torch_hidden_state).squeeze()
+        next_matrix_A, next_log_matrix_A_probs, next_messg_split = self._act_graph(next_full_obs, self.next_hidden_state)
+        if self._reuse_next_graph:
+            self._next_graph = (next_matrix_A, next_log_matrix_A_probs, next_messg_split)
 
         # next_obs_messg  = []
         # for i in range(self.agent_num):
         #     next_messg_i =  next_messg_split[i]
         #     next_obs_messg.append(np.concatenate([next_messg_i.detach().numpy()]))
 
-        for i, agent in enumerate(self.agents):
-            action = deepcopy(action_n[i])
-            adj_mat = deepcopy(self.matrix_A_list)
-            log_adj_mat = deepcopy(self.log_matrix_A_probs_list)
-            if agent.pool.joint:
-                opponent_action = deepcopy(action_n)
-                del opponent_action[i]
-                opponent_action = np.array(opponent_action).flatten()
-                agent.pool.add_sample(observation=messg_split[i].detach().numpy(),
-                                      action=action,
-                                      reward=reward_n[i],
-                                      terminal=done_n[i],
-                                      next_observation=next_messg_split[i].detach().numpy(),
-                                      opponent_action=opponent_action,
-                                      adj_mat=adj_mat, 
-                                      log_adj_mat=log_adj_mat)
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.add_sample(observation_n=list(messg_split),
+                                     action_n=action_n,
+                                     reward_n=reward_n,
+                                     terminal_n=done_n,
+                                     next_observation_n=list(next_messg_split),
+                                     adj_mat=self.matrix_A_list,
+                                     log_adj_mat=self.log_matrix_A_probs_list,
+                                     full_obs=full_obs)
             else:
-                agent.pool.add_sample(observation=messg_split[i].detach().numpy(),
-                                      action=action,
-                                      reward=reward_n[i],
-                                      terminal=done_n[i],
-                                      next_observation=next_messg_split[i].detach().numpy(),
-                                      adj_mat=adj_mat, 
-                                      log_adj_mat=log_adj_mat)
+                for i, agent in enumerate(self.agents):
+                    action = deepcopy(action_n[i])
+                    adj_mat = deepcopy(self.matrix_A_list)
+                    log_adj_mat = deepcopy(self.log_matrix_A_probs_list)
+                    if agent.pool.joint:
+                        opponent_action = deepcopy(action_n)
+                        del opponent_action[i]
+                        opponent_action = np.array(opponent_action).flatten()
+                        agent.pool.add_sample(observation=messg_split[i],
+                                              action=action,
+                                              reward=reward_n[i],
+                                              terminal=done_n[i],
+                                              next_observation=next_messg_split[i],
+                                              opponent_action=opponent_action,
+                                              adj_mat=adj_mat, 
+                                              log_adj_mat=log_adj_mat,
+                                              full_obs=full_obs)
+                    else:
+                        agent.pool.add_sample(observation=messg_split[i],
+                                              action=action,
+                                              reward=reward_n[i],
+                                              terminal=done_n[i],
+                                              next_observation=next_messg_split[i],
+                                              adj_mat=adj_mat, 
+                                              log_adj_mat=log_adj_mat,
+                                              full_obs=full_obs)
 
         if np.all(done_n) or self._path_length >= self._max_path_length:
             self._current_observation_n = self.env.reset()
+            self._next_graph = None
+            self._reset_noise()
             self._max_path_return = np.maximum(self._max_path_return, self._path_return)
             self._mean_path_return = self._path_return / self._path_length
             self._last_path_return = self._path_return
@@ -320,6 +385,153 @@ class GrMASampler(SimpleSampler):
         logger.record_tabular('total-samples', self._total_samples)
 
 
+class GrMAVecSampler(GrMASampler):
+    """GrMASampler that advances `n_envs` environment copies per `sample()`.
+
+    The graph policy runs once over the (n_envs, full_obs_dim) batch of joint
+    observations, every agent policy is queried once over n_envs rows and the
+    resulting n_envs transitions are written to each agent's pool at once.
+    """
+    def __init__(self, agent_num, joint, graph_policy, n_envs=1, **kwargs):
+        super(GrMAVecSampler, self).__init__(agent_num, joint, graph_policy, **kwargs)
+        self.n_envs = n_envs
+        self.envs = None
+        self._path_length = np.zeros(self.n_envs, dtype=np.int32)
+        self._path_return = np.zeros((self.n_envs, self.agent_num), dtype=np.float32)
+        self._mean_path_return = np.zeros(self.agent_num, dtype=np.float32)
+        self._stale_graph = np.zeros(self.n_envs, dtype=bool)
+
+    def initialize(self, envs, agents, pool=None):
+        if not isinstance(envs, (list, tuple)):
+            envs = [envs]
+        assert len(envs) == self.n_envs
+        self._current_observation_n = None
+        self.envs = list(envs)
+        self.env = self.envs[0]
+        self.agents = agents
+        self.pool = pool
+        # one exploration noise process per environment copy
+        for agent in agents:
+            noise = getattr(agent.policy, 'noise', None)
+            if noise is not None:
+                noise.set_n_envs(self.n_envs)
+
+    def terminate(self):
+        for env in self.envs:
+            env.terminate()
+
+    def _full_obs_batch(self, observation_n_list):
+        return np.stack([np.hstack(observation_n) for observation_n in observation_n_list])
+
+    def _graph_batch(self, full_obs, hidden_state):
+        matrix_A, log_matrix_A_probs, messg_split = self.graph_policy.act(full_obs, hidden_state)
+        return matrix_A, log_matrix_A_probs.reshape((-1, 1)), messg_split
+
+    def _hidden_state_batch(self, full_obs):
+        return full_obs.reshape((len(full_obs), self.agent_num, self.agents[0]._observation_dim))
+
+    def sample(self):
+        if self._current_observation_n is None:
+            self._current_observation_n = [env.reset() for env in self.envs]
+
+        full_obs = self._full_obs_batch(self._current_observation_n)
+        self.hidden_state = self._hidden_state_batch(full_obs)
+        if self._reuse_next_graph and self._next_graph is not None:
+            # environments that were reset have no carried graph; copy the
+            # carried arrays so the ones handed out last step are not modified
+            matrix_A, log_matrix_A_probs, messg_split = [a.copy() for a in self._next_graph]
+            stale = self._stale_graph
+            if stale.any():
+                matrix_A[stale], log_matrix_A_probs[stale], messg_split[stale] = self._graph_batch(
+                    full_obs[stale], self.hidden_state[stale])
+        else:
+            matrix_A, log_matrix_A_probs, messg_split = self._graph_batch(full_obs, self.hidden_state)
+
+        self.full_obs_list = full_obs
+        self.matrix_A_list = matrix_A
+        self.log_matrix_A_probs_list = log_matrix_A_probs
+        self.obs_messg_list = messg_split
+
+        # one batched policy call per agent over all environment copies
+        action_n = []
+        for i, agent in enumerate(self.agents):
+            actions = np.array(self._actor(i).get_env_actions(messg_split[:, i]))
+            if agent.joint_policy:
+                actions = actions[:, 0:agent._action_dim]
+            action_n.append(actions)
+
+        next_observation_n_list = []
+        reward_n = np.zeros((self.n_envs, self.agent_num), dtype=np.float32)
+        done_n = np.zeros((self.n_envs, self.agent_num), dtype=bool)
+        env_action_n = [[actions[e] for actions in action_n] for e in range(self.n_envs)]
+        if hasattr(self.env, 'step_batch'):
+            results = self.env.step_batch(self.envs, env_action_n)
+        else:
+            results = [env.step(actions) for env, actions in zip(self.envs, env_action_n)]
+        for e, (next_observation_n, reward, done, _) in enumerate(results):
+            next_observation_n_list.append(next_observation_n)
+            reward_n[e] = reward
+            done_n[e] = done
+        self._path_length += 1
+        self._path_return += reward_n
+        self._total_samples += self.n_envs
+
+        next_full_obs = self._full_obs_batch(next_observation_n_list)
+        if self._reuse_next_graph:
+            next_matrix_A, next_log_matrix_A_probs, next_messg_split = self._graph_batch(
+                next_full_obs, self._hidden_state_batch(next_full_obs))
+            self._next_graph = (next_matrix_A, next_log_matrix_A_probs, next_messg_split)
+            self._stale_graph = np.zeros(self.n_envs, dtype=bool)
+        else:
+            # as in GrMASampler, the next message aggregates the current hidden state
+            next_matrix_A, next_log_matrix_A_probs, next_messg_split = self._graph_batch(next_full_obs, self.hidden_state)
+
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.add_samples(observations_n=[messg_split[:, i] for i in range(self.agent_num)],
+                                      actions_n=action_n,
+                                      rewards=reward_n,
+                                      terminals=done_n,
+                                      next_observations_n=[next_messg_split[:, i] for i in range(self.agent_num)],
+                                      adj_mats=self.matrix_A_list,
+                                      log_adj_mats=self.log_matrix_A_probs_list,
+                                      full_obs=full_obs)
+            else:
+                for i, agent in enumerate(self.agents):
+                    kwargs = {}
+                    if agent.pool.joint:
+                        kwargs['opponent_actions'] = np.hstack([action_n[j] for j in range(self.agent_num) if j != i])
+                    agent.pool.add_samples(observations=messg_split[:, i],
+                                           actions=action_n[i],
+                                           rewards=reward_n[:, i],
+                                           terminals=done_n[:, i],
+                                           next_observations=next_messg_split[:, i],
+                                           adj_mats=self.matrix_A_list,
+                                           log_adj_mats=self.log_matrix_A_probs_list,
+                                           full_obs=full_obs,
+                                           **kwargs)
+
+        ended_envs = []
+        for e, env in enumerate(self.envs):
+            if np.all(done_n[e]) or self._path_length[e] >= self._max_path_length:
+                next_observation_n_list[e] = env.reset()
+                if self._next_graph is not None:
+                    self._stale_graph[e] = True
+                self._max_path_return = np.maximum(self._max_path_return, self._path_return[e])
+                self._mean_path_return = self._path_return[e] / self._path_length[e]
+                self._last_path_return = self._path_return[e].copy()
+
+                self._path_length[e] = 0
+                self._path_return[e] = 0.
+                self._n_episodes += 1
+                ended_envs.append(e)
+
+        self._current_observation_n = next_observation_n_list
+        if ended_envs:
+            self._reset_noise(ended_envs)
+            self.log_diagnostics()
+            logger.dump_tabular(with_prefix=False)
+
 
 class DummySampler(Sampler):
     def __init__(self, batch_size, max_path_length):
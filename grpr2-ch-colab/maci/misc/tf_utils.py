@@ -168,6 +168,36 @@ def minimize_and_clip(optimizer, objective, var_list, clip_val=10):
         return optimizer.apply_gradients(gradients)
 
 
+# ================================================================
+# Flat parameter vectors
+# ================================================================
+
+
+def _numel(param):
+    return int(np.prod(param.shape.as_list()))
+
+
+def flat_concat(params):
+    """All of `params` as one flat vector, in order."""
+    return tf.concat([tf.reshape(p, [-1]) for p in params], axis=0)
+
+
+def assign_from_flat(params, flat, name=None):
+    """Op writing the flat vector `flat` back into `params`."""
+    splits = tf.split(flat, [_numel(p) for p in params])
+    return tf.group(*[tf.compat.v1.assign(p, tf.reshape(value, p.shape)) for p, value in zip(params, splits)],
+                    name=name)
+
+
+def polyak_update(targets, sources, tau, name=None):
+    """One fused soft update target <- (1 - tau) * target + tau * source for
+    a whole network. Both lists are read as one flat vector each, so the
+    averaging is a single elementwise kernel instead of one per variable.
+    `targets` and `sources` must be paired in order."""
+    mixed = (1 - tau) * flat_concat(targets) + tau * flat_concat(sources)
+    return assign_from_flat(targets, mixed, name=name)
+
+
 # ================================================================
 # Global session
 # ================================================================
@@ -177,11 +207,16 @@ def get_session():
     return tf.compat.v1.get_default_session()
 
 
-def make_session(num_cpu):
-    """Returns a session that will use <num_cpu> CPU's only"""
+def make_session(num_cpu=1, intra_op_threads=None, inter_op_threads=None):
+    """Returns a session that will use <num_cpu> CPU's only.
+
+    `intra_op_threads` (threads inside one op) and `inter_op_threads`
+    (ops, and concurrent `Session.run` calls, executed in parallel)
+    override <num_cpu> for their pool.
+    """
     tf_config = tf.compat.v1.ConfigProto(
-        inter_op_parallelism_threads=num_cpu,
-        intra_op_parallelism_threads=num_cpu)
+        inter_op_parallelism_threads=num_cpu if inter_op_threads is None else inter_op_threads,
+        intra_op_parallelism_threads=num_cpu if intra_op_threads is None else intra_op_threads)
     return tf.compat.v1.Session(config=tf_config)
 
 
@@ -200,6 +235,15 @@ def initialize():
     ALREADY_INITIALIZED.update(new_variables)
 
 
+def finalize_graph(graph=None):
+    """Finalize the (default) graph so that any later op creation raises instead of
+    silently growing the graph, e.g. a `tf.stop_gradient` built inside a training loop."""
+    if graph is None:
+        graph = tf.compat.v1.get_default_graph()
+    graph.finalize()
+    return graph
+
+
 # ================================================================
 # Scopes
 # ================================================================
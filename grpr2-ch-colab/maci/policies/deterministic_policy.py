@@ -6,6 +6,7 @@ import tensorflow as tf
 from maci.core.serializable import Serializable
 
 from maci.misc.nn import feedforward_net
+from maci.misc.noise import OUActionNoise
 
 from maci.policies.nn_policy import NNPolicy
 
@@ -65,7 +66,8 @@ class DeterministicNNPolicy(NNPolicy, Serializable):
         self.mu = mu
         self.theta = theta
         self.sigma = sigma
-        self.state = np.ones(self._action_dim) * self.mu
+        # one exploration process per environment, see `set_noise`
+        self.noise = OUActionNoise(self._action_dim, mu=mu, theta=theta, sigma=sigma)
 
         self._observation_ph = tf.compat.v1.placeholder(
             tf.float32,
@@ -77,14 +79,13 @@ class DeterministicNNPolicy(NNPolicy, Serializable):
         super(DeterministicNNPolicy, self).__init__(
             env_spec, self._observation_ph, self._actions, self._name)
 
-    def evolve_noise_state(self):
-        x = self.state
-        dx = self.theta * (self.mu - x) + self.sigma * np.random.randn(len(x))
-        self.state = x + dx
-        return self.state
+    def reset_noise(self, env_ids=None):
+        self.noise.reset(env_ids)
 
-    def reset_noise(self):
-        self.state = np.ones(self._action_dim) * self.mu
+    def set_noise(self, noise):
+        """Replace the exploration noise, e.g. by a `GaussianActionNoise` or
+        an `OUActionNoise` with one process per sampler environment."""
+        self.noise = noise
 
     def set_noise_level(self, noise_level):
         # print(noise_level)
@@ -92,13 +93,23 @@ class DeterministicNNPolicy(NNPolicy, Serializable):
         self.noise_level = noise_level
 
     def get_action(self, observation):
-        return self.get_actions(observation[None])[0], None
+        return self.get_env_actions(observation[None])[0], None
 
     def get_actions(self, observations):
         feeds = {self._observation_ph: observations}
         actions = tf.compat.v1.get_default_session().run(self._action, feeds)
         # return actions
-        return np.clip(actions + self._u_range * self.noise_level * self.evolve_noise_state(), -self._u_range, self._u_range)
+        return self._explore(actions, self.noise.sample_stationary(len(actions)))
+
+    def get_env_actions(self, observations):
+        """`get_actions` for one sampler environment per row, with the noise
+        of each environment's process."""
+        feeds = {self._observation_ph: observations}
+        actions = tf.compat.v1.get_default_session().run(self._action, feeds)
+        return self._explore(actions, self.noise.sample_envs())
+
+    def _explore(self, actions, noise):
+        return np.clip(actions + self._u_range * self.noise_level * noise, -self._u_range, self._u_range)
 
     def actions_for(self, observations, reuse=False):
 
@@ -179,7 +190,8 @@ class ConditionalDeterministicNNPolicy(NNPolicy, Serializable):
         self.mu = mu
         self.theta = theta
         self.sigma = sigma
-        self.state = np.ones(self._action_dim) * self.mu
+        # one exploration process per environment, see `set_noise`
+        self.noise = OUActionNoise(self._action_dim, mu=mu, theta=theta, sigma=sigma)
 
         self._observation_ph = tf.compat.v1.placeholder(
             tf.float32,
@@ -196,14 +208,13 @@ class ConditionalDeterministicNNPolicy(NNPolicy, Serializable):
         super(ConditionalDeterministicNNPolicy, self).__init__(
             env_spec, self._observation_ph, self._actions, self._name)
 
-    def evolve_noise_state(self):
-        x = self.state
-        dx = self.theta * (self.mu - x) + self.sigma * np.random.randn(len(x))
-        self.state = x + dx
-        return self.state
+    def reset_noise(self, env_ids=None):
+        self.noise.reset(env_ids)
 
-    def reset_noise(self):
-        self.state = np.ones(self._action_dim) * self.mu
+    def set_noise(self, noise):
+        """Replace the exploration noise, e.g. by a `GaussianActionNoise` or
+        an `OUActionNoise` with one process per sampler environment."""
+        self.noise = noise
 
     def set_noise_level(self, noise_level):
         # print(noise_level)
@@ -211,13 +222,23 @@ class ConditionalDeterministicNNPolicy(NNPolicy, Serializable):
         self.noise_level = noise_level
 
     def get_action(self, observation, action):
-        return self.get_actions(observation[None], action[None])[0], None
+        return self.get_env_actions(observation[None], action[None])[0], None
 
     def get_actions(self, observations, self_actions):
         feeds = {self._observation_ph: observations, self._actions_ph: self_actions}
-        actions = tf.compat.v1.get_default_session().run(self._opponent_actions, feeds)
+        actions = tf.compat.v1.get_default_session().run(self._actions, feeds)
         # return actions
-        return np.clip(actions + self._u_range * self.noise_level * self.evolve_noise_state(), -self._u_range, self._u_range)
+        return self._explore(actions, self.noise.sample_stationary(len(actions)))
+
+    def get_env_actions(self, observations, self_actions):
+        """`get_actions` for one sampler environment per row, with the noise
+        of each environment's process."""
+        feeds = {self._observation_ph: observations, self._actions_ph: self_actions}
+        actions = tf.compat.v1.get_default_session().run(self._actions, feeds)
+        return self._explore(actions, self.noise.sample_envs())
+
+    def _explore(self, actions, noise):
+        return np.clip(actions + self._u_range * self.noise_level * noise, -self._u_range, self._u_range)
 
 
     def actions_for(self, observations, actions, reuse=False):
@@ -296,7 +317,8 @@ class DeterministicToMNNPolicy(NNPolicy, Serializable):
         self.mu = mu
         self.theta = theta
         self.sigma = sigma
-        self.state = np.ones(self._action_dim) * self.mu
+        # one exploration process per environment, see `set_noise`
+        self.noise = OUActionNoise(self._action_dim, mu=mu, theta=theta, sigma=sigma)
 
         self._observation_ph = tf.compat.v1.placeholder(
             tf.float32,
@@ -308,14 +330,13 @@ class DeterministicToMNNPolicy(NNPolicy, Serializable):
         super(DeterministicToMNNPolicy, self).__init__(
             env_spec, self._observation_ph, self._actions, self._name)
 
-    def evolve_noise_state(self):
-        x = self.state
-        dx = self.theta * (self.mu - x) + self.sigma * np.random.randn(len(x))
-        self.state = x + dx
-        return self.state
+    def reset_noise(self, env_ids=None):
+        self.noise.reset(env_ids)
 
-    def reset_noise(self):
-        self.state = np.ones(self._action_dim) * self.mu
+    def set_noise(self, noise):
+        """Replace the exploration noise, e.g. by a `GaussianActionNoise` or
+        an `OUActionNoise` with one process per sampler environment."""
+        self.noise = noise
 
     def set_noise_level(self, noise_level):
         # print(noise_level)
@@ -323,13 +344,23 @@ class DeterministicToMNNPolicy(NNPolicy, Serializable):
         self.noise_level = noise_level
 
     def get_action(self, observation):
-        return self.get_actions(observation[None])[0], None
+        return self.get_env_actions(observation[None])[0], None
 
     def get_actions(self, observations):
         feeds = {self._observation_ph: observations}
         actions = tf.compat.v1.get_default_session().run(self._action, feeds)
         # return actions
-        return np.clip(actions + self._u_range * self.noise_level * self.evolve_noise_state(), -self._u_range, self._u_range)
+        return self._explore(actions, self.noise.sample_stationary(len(actions)))
+
+    def get_env_actions(self, observations):
+        """`get_actions` for one sampler environment per row, with the noise
+        of each environment's process."""
+        feeds = {self._observation_ph: observations}
+        actions = tf.compat.v1.get_default_session().run(self._action, feeds)
+        return self._explore(actions, self.noise.sample_envs())
+
+    def _explore(self, actions, noise):
+        return np.clip(actions + self._u_range * self.noise_level * noise, -self._u_range, self._u_range)
 
     def actions_for(self, observations, reuse=False):
         opponent_actions_ = self.cond_policy.actions_for(observations)
@@ -9,6 +9,7 @@ import torch.nn.functional as F
 from torch import nn
 import numpy as np
 import tensorflow as tf
+from functools import lru_cache
 
 def one_hot(inputs, vocab_size = None):
     """Returns one hot of data over each element of the inputs"""
@@ -39,12 +40,27 @@ def multiplicative_inverse(a, n):
     """
 
     vocab_size = a.shape[-1]
-    a_dtype = a.dtype
     sparse_a = torch.argmax(a, dim=-1)
-    sparse_outputs = torch.tensor(py_multiplicative_inverse( sparse_a, n))
-    z = one_hot(sparse_outputs, vocab_size)
+    sparse_outputs = inverse_table(int(n), a.device)[sparse_a]
+    if (sparse_outputs < 0).any():
+        bad = sparse_a[sparse_outputs < 0][0].item()
+        raise ValueError(
+            'Inverse for {} modulo {} does not exist.'.format(bad, n))
+    z = F.one_hot(sparse_outputs, vocab_size).type(a.dtype)
     return z
 
+@lru_cache(maxsize=None)
+def inverse_table(n, device=None):
+    """Long tensor of the multiplicative inverses of 0..n-1 modulo n, cached
+    per (n, device). Entries without an inverse are -1."""
+    table = []
+    for a in range(n):
+        try:
+            table.append(int(py_multiplicative_inverse(a, n)))
+        except ValueError:
+            table.append(-1)
+    return torch.tensor(table, dtype=torch.long, device=device)
+
 def py_multiplicative_inverse(a, n):
     """Multiplicative inverse of a modulo n (in Python).
     Implements extended Euclidean algorithm.
@@ -114,18 +130,31 @@ def one_hot_add(inputs, shift):
     Returns:
         Tensor of same shape and dtype as inputs.
     """
-    inputs = torch.stack((inputs, torch.zeros_like(inputs)), dim = -1)
-    shift = torch.stack((shift, torch.zeros_like(shift)), dim = -1)
-    inputs_fft = torch.fft.fft(inputs, 1) #ignore last and first dimension to do batched fft
-    shift_fft = torch.fft.fft(shift, 1)
-    result_fft_real = inputs_fft.real*shift_fft.real - inputs_fft.imag*shift_fft.imag
-    result_fft_imag = inputs_fft.real*shift_fft.imag + inputs_fft.imag*shift_fft.real
-    result_fft = torch.stack((result_fft_real,result_fft_imag), dim = -1)
-    return torch.fft.ifft(result_fft, 1).real #return only the real part
+    # circular convolution over the vocabulary axis
+    inputs_fft = torch.fft.fft(inputs, dim=-1)
+    shift_fft = torch.fft.fft(shift.type(inputs.dtype), dim=-1)
+    return torch.fft.ifft(inputs_fft * shift_fft, dim=-1).real.type(inputs.dtype) #return only the real part
     # inputs = tf.cast(inputs.detach(), tf.complex64)
     # shift = tf.cast(shift.detach(), tf.complex64)
     # return tf.math.real(tf.signal.ifft(tf.signal.fft(inputs) * tf.signal.fft(shift)))
 
+def binary_add(inputs, shift):
+    """Performs (inputs + shift) % 2 for a vocabulary of size 2.
+    Args:
+        inputs: Tensor of hard/soft bits, the value of index 1 of a one-hot pair.
+        shift: Tensor of hard/soft bits with the same shape as inputs.
+    Returns:
+        Tensor of same shape as inputs. For hard bits this is inputs XOR shift;
+        for soft bits it is the same polynomial `one_hot_add`/`one_hot_minus`
+        compute on the pairs [1 - x, x] (read back at index 1), so values and
+        gradients agree with the one-hot path.
+    """
+    shift = shift.type(inputs.dtype)
+    return inputs + shift - 2. * inputs * shift
+
+# modulo 2 every element is its own inverse
+binary_minus = binary_add
+
 def one_hot_multiply(inputs, scale):
     """Performs (inputs * scale) % vocab_size in the one-hot space.
     Args:
@@ -141,17 +170,24 @@ def one_hot_multiply(inputs, scale):
     """
 
     scale = scale.type( inputs.dtype)
-    batch_shape = list(inputs.shape[:-1])
     vocab_size = inputs.shape[-1]
-    # Form a [..., vocab_size, vocab_size] tensor. The ith row of the
-    # batched vocab_size x vocab_size matrix represents scaling inputs by i.
-    to_perm = torch.arange(vocab_size).unsqueeze(1).repeat(1, vocab_size) * torch.arange(vocab_size).unsqueeze(0)
-    permutation_matrix = one_hot(torch.fmod(to_perm,vocab_size))
+    # [vocab_size, vocab_size, vocab_size] tensor. The ith row of the
+    # batched vocab_size x vocab_size matrix represents scaling inputs by i;
+    # the row for scaling by zero is all zeros.
+    permutation_matrix = scale_permutation_matrix(vocab_size, inputs.device, inputs.dtype)
     # Scale the inputs according to the permutation matrix of all possible scales.
     scaled_inputs = torch.einsum('...v,avu->...au', inputs, permutation_matrix)
-    scaled_inputs = torch.cat( (torch.zeros(batch_shape + [1, vocab_size]),
-                                scaled_inputs[..., 1:, :]), dim=-2)
     # Reduce rows of the scaled inputs by the scale values. This forms a
     # weighted linear combination of scaling by zero, scaling by one, and so on.
     outputs = torch.einsum('...v,...vu->...u', scale, scaled_inputs)
     return outputs
+
+@lru_cache(maxsize=None)
+def scale_permutation_matrix(vocab_size, device=None, dtype=torch.float32):
+    """Permutation matrices of `one_hot_multiply`, cached per
+    (vocab_size, device, dtype). Entry [a, v, u] is 1 iff a * v % vocab_size
+    == u, with the a == 0 slice zeroed."""
+    to_perm = torch.arange(vocab_size).unsqueeze(1) * torch.arange(vocab_size).unsqueeze(0)
+    permutation_matrix = F.one_hot(torch.fmod(to_perm, vocab_size), vocab_size).type(dtype)
+    permutation_matrix[0] = 0.
+    return permutation_matrix.to(device)
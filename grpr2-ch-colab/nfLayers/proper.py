@@ -18,6 +18,11 @@ class AugmentedLagrangian(nn.Module):
         self.raw_cost = 0
         self.register_buffer('thr', torch.ones(1)*thr)
 
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        # tensor hooks are not copied along with the module
+        self.lam_hook = self.lam.register_hook(lambda grad: self.lambda_hook_fn(grad))
+
     def lambda_hook_fn(self, grad):
         self.backward_count += 1
         self.cumulated_grad_lambda -= grad.item()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tree root holds the `maci` package and is not installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
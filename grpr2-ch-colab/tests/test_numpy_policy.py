@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+pytest.importorskip('rllab')
+
+from maci.policies.deterministic_policy import ConditionalDeterministicNNPolicy, DeterministicNNPolicy
+from maci.policies.numpy_policy import NumpyActorEngine
+
+
+OBS_DIM, ACTION_DIM, N_AGENTS = 4, 3, 2
+
+
+class _Space(list):
+    def opponent_flat_dim(self, i):
+        return sum(space.flat_dim for j, space in enumerate(self) if j != i)
+
+
+def _env_spec():
+    space = lambda dim: _Space(SimpleNamespace(flat_dim=dim) for _ in range(N_AGENTS))
+    return SimpleNamespace(observation_space=space(OBS_DIM), action_space=space(ACTION_DIM))
+
+
+@pytest.mark.parametrize('noise_level', [0., 0.3])
+def test_conditional_deterministic_actor_matches_policy(noise_level):
+    rng = np.random.RandomState(0)
+    observations = rng.randn(5, OBS_DIM).astype(np.float32)
+    opponent_actions = rng.uniform(-1, 1, (5, ACTION_DIM * (N_AGENTS - 1))).astype(np.float32)
+    with tf.Graph().as_default(), tf.compat.v1.Session() as sess, sess.as_default():
+        policies = [DeterministicNNPolicy(observation_space=SimpleNamespace(flat_dim=OBS_DIM),
+                                          action_space=SimpleNamespace(flat_dim=ACTION_DIM),
+                                          hidden_layer_sizes=(8, 8), squash=True, agent_id=0,
+                                          noise_level=noise_level),
+                    ConditionalDeterministicNNPolicy(env_spec=_env_spec(), hidden_layer_sizes=(8, 8), squash=True,
+                                                     agent_id=0, noise_level=noise_level)]
+        sess.run(tf.compat.v1.global_variables_initializer())
+        engine = NumpyActorEngine(policies)
+
+        for policy, actor in zip(policies, engine.actors):
+            inputs = (observations,) if isinstance(policy, DeterministicNNPolicy) else (observations, opponent_actions)
+            for method in ['get_actions', 'get_env_actions']:
+                # the same noise draws for the TF policy and its NumPy mirror
+                np.random.seed(1)
+                policy.reset_noise()
+                expected = getattr(policy, method)(*inputs)
+                np.random.seed(1)
+                policy.reset_noise()
+                actions = getattr(actor, method)(*inputs)
+                np.testing.assert_allclose(actions, expected, rtol=1e-5, atol=1e-6)
+            if noise_level:
+                np.random.seed(1)
+                assert not np.allclose(actor.get_actions(*inputs), actor.actions_for(*inputs))
@@ -0,0 +1,72 @@
+import copy
+
+import numpy as np
+import pytest
+
+pytest.importorskip('multiagent.core')
+
+import maci.envs.mpe_scenarios as scenarios
+from multiagent.core import VecWorld
+
+
+def _worlds(scenario):
+    np.random.seed(0)
+    world = scenario.make_world()
+    vec_world = scenario.make_world(vectorized=True)
+    for entity, vec_entity in zip(world.entities, vec_world.entities):
+        vec_entity.state = copy.deepcopy(entity.state)
+    return world, vec_world
+
+
+def _set_actions(world, vec_world, rng):
+    for agent, vec_agent in zip(world.agents, vec_world.agents):
+        agent.action.u = rng.uniform(-1, 1, world.dim_p)
+        agent.action.c = np.zeros(world.dim_c)
+        vec_agent.action.u = agent.action.u.copy()
+        vec_agent.action.c = agent.action.c.copy()
+
+
+def _step(world, vec_world, rng):
+    _set_actions(world, vec_world, rng)
+    world.step()
+    vec_world.step()
+
+
+def _assert_same_state(world, vec_world):
+    for entity, vec_entity in zip(world.entities, vec_world.entities):
+        np.testing.assert_allclose(vec_entity.state.p_pos, entity.state.p_pos, rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(vec_entity.state.p_vel, entity.state.p_vel, rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize('name', ['simple_spread_local', 'simple_spread_hetero'])
+def test_vec_world_matches_world_step(name):
+    scenario = scenarios.load(name + '.py').Scenario()
+    world, vec_world = _worlds(scenario)
+    rng = np.random.RandomState(0)
+    for _ in range(50):
+        _step(world, vec_world, rng)
+        _assert_same_state(world, vec_world)
+    # the entity states are views into the arrays the steps integrate
+    assert all(np.shares_memory(entity.state.p_pos, vec_world.pos) for entity in vec_world.entities)
+
+    # a reset reassigns the entity states, so the arrays are rebound
+    scenario.reset_world(world)
+    for entity, vec_entity in zip(world.entities, vec_world.entities):
+        vec_entity.state = copy.deepcopy(entity.state)
+    vec_world.reset_state()
+    for _ in range(10):
+        _step(world, vec_world, rng)
+        _assert_same_state(world, vec_world)
+
+
+def test_step_worlds_matches_single_steps():
+    scenario = scenarios.load('simple_spread_local.py').Scenario()
+    pairs = [_worlds(scenario) for _ in range(3)]
+    rng = np.random.RandomState(1)
+    for _ in range(20):
+        for world, vec_world in pairs:
+            _set_actions(world, vec_world, rng)
+            world.step()
+        VecWorld.step_worlds([vec_world for _, vec_world in pairs])
+        for world, vec_world in pairs:
+            _assert_same_state(world, vec_world)
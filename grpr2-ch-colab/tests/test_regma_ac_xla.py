@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+pytest.importorskip('rllab')
+
+from maci.environments import make_particle_env
+from maci.get_agents import regma_ac_agent
+from maci.misc import tf_utils
+
+
+def _train_one_step(env, xla, seed, weights=None, batch_size=32):
+    """Build a level-k agent, load `weights` (if given) and run one update.
+
+    Returns:
+        The initial weights, the update's TD, individual-Q and policy
+        losses, and all variables after the update. They include the Adam
+        moments, so the gradients are compared too, not only the steps
+        (the first Adam step is about lr * sign(gradient)).
+    """
+    base_kwargs = dict(sampler=None, epoch_length=1, n_epochs=1, n_train_repeat=1)
+    with tf.Graph().as_default():
+        # single-threaded, so the reductions of both runs are deterministic
+        with tf_utils.single_threaded_session() as sess, sess.as_default():
+            tf.compat.v1.set_random_seed(seed)
+            agent = regma_ac_agent('GrPR2AC2', env.n, 0, env, 16, 1., base_kwargs,
+                                   k=2, game_name='particle', xla=xla)
+            variables = tf.compat.v1.global_variables()
+            if weights is None:
+                weights = sess.run(variables)
+            else:
+                for variable, value in zip(variables, weights):
+                    variable.load(value, sess)
+            agent._init_training()
+
+            rng = np.random.RandomState(seed)
+            batch = dict(observations=rng.randn(batch_size, agent._observation_dim),
+                         next_observations=rng.randn(batch_size, agent._observation_dim),
+                         actions=rng.rand(batch_size, agent._action_dim),
+                         next_actions=rng.rand(batch_size, agent._action_dim),
+                         opponent_actions=rng.rand(batch_size, agent._opponent_action_dim),
+                         rewards=rng.randn(batch_size),
+                         terminals=np.zeros(batch_size))
+            feed_dict = agent._get_feed_dict(batch)
+            # The training ops read variables that other training ops write,
+            # in no fixed order within one run, so the losses and every op
+            # get a run of their own and the update is reproducible.
+            losses = sess.run([agent._bellman_residual, agent._ind_bellman_residual, agent._pg_loss], feed_dict)
+            for training_op in agent._training_ops:
+                sess.run(training_op, feed_dict)
+            trained = sess.run(tf.compat.v1.global_variables())
+    return weights, losses, trained
+
+
+def _assert_close(actual, desired):
+    # the float32 rounding of a sum scales with its largest terms, not with
+    # the result, so the absolute tolerance follows each array's scale
+    np.testing.assert_allclose(actual, desired, rtol=1e-4, atol=1e-6 + 1e-4 * np.abs(desired).max())
+
+
+def test_xla_update_matches():
+    env = make_particle_env('simple_spread_local')
+    weights, losses, trained = _train_one_step(env, xla=False, seed=0)
+    _, xla_losses, xla_trained = _train_one_step(env, xla=True, seed=0, weights=weights)
+
+    np.testing.assert_allclose(xla_losses, losses, rtol=1e-4, atol=1e-6)
+    assert len(xla_trained) == len(trained)
+    for xla_value, value in zip(xla_trained, trained):
+        _assert_close(xla_value, value)
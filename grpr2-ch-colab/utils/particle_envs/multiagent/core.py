@@ -327,3 +327,124 @@ class World(object):
         force[perp_dim] = np.cos(theta) * force_mag
         force[prll_dim] = np.sin(theta) * np.abs(force_mag)
         return force
+
+# pairwise contact forces on (..., N, D) positions; forces[..., i, :] is the
+# total force applied to entity i by every other entity
+def entity_collision_forces(pos, size, mass, movable, collide, contact_force, contact_margin):
+    n = pos.shape[-2]
+    delta_pos = pos[..., :, None, :] - pos[..., None, :, :]
+    dist = np.sqrt(np.sum(np.square(delta_pos), axis=-1))
+    dist_min = size[:, None] + size[None, :]
+    # only colliding pairs with at least one movable entity exert forces
+    mask = collide[:, None] & collide[None, :] & (movable[:, None] | movable[None, :])
+    mask &= ~np.eye(n, dtype=bool)
+    # softmax penetration
+    k = contact_margin
+    penetration = np.logaddexp(0, -(dist - dist_min) / k) * k
+    safe_dist = np.where(mask, dist, 1.0)
+    force = contact_force * delta_pos / safe_dist[..., None] * penetration[..., None]
+    # consider mass in collisions between two movable entities
+    force_ratio = np.where(movable[:, None] & movable[None, :], mass[None, :] / mass[:, None], 1.0)
+    weight = np.where(mask & movable[:, None], force_ratio, 0.0)
+    return np.sum(force * weight[..., None], axis=-2)
+
+# damping, force integration, max-speed clamping and position update on
+# (..., N, D) arrays; only movable entities are updated
+def integrate_entity_state(pos, vel, force, mass, movable, max_speed, damping, dt):
+    move = movable[:, None]
+    vel = np.where(move, vel * (1 - damping) + (force / mass[:, None]) * dt, vel)
+    speed = np.sqrt(np.sum(np.square(vel), axis=-1, keepdims=True))
+    clamp = move & (speed > max_speed[:, None])
+    vel = vel * np.where(clamp, max_speed[:, None] / np.where(clamp, speed, 1.0), 1.0)
+    pos = np.where(move, pos + vel * dt, pos)
+    return pos, vel
+
+# multi-agent world with array-backed physics; entity states are views into
+# contiguous (N, D) arrays that each step integrates in place
+class VecWorld(World):
+    def __init__(self):
+        super(VecWorld, self).__init__()
+        # (N, D) position and velocity arrays; the entity states are views
+        # into their rows once bound (see bind_state)
+        self.pos = None
+        self.vel = None
+        self._properties = None
+
+    # drop the cached properties and state arrays; call after anything
+    # (e.g. a scenario's reset_world) reassigns entity states or properties
+    def reset_state(self):
+        self.pos = None
+        self.vel = None
+        self._properties = None
+
+    # static entity properties as arrays (size, mass, movable, collide, max_speed)
+    def entity_properties(self):
+        if self._properties is None:
+            entities = self.entities
+            size = np.array([entity.size for entity in entities], dtype=np.float64)
+            mass = np.array([entity.mass for entity in entities], dtype=np.float64)
+            movable = np.array([entity.movable for entity in entities], dtype=bool)
+            collide = np.array([entity.collide for entity in entities], dtype=bool)
+            max_speed = np.array([np.inf if entity.max_speed is None else entity.max_speed
+                                  for entity in entities], dtype=np.float64)
+            self._properties = size, mass, movable, collide, max_speed
+        return self._properties
+
+    # copy the entity states into the state arrays and rebind each entity's
+    # p_pos / p_vel to its row, so steps update them in place
+    def bind_state(self):
+        entities = self.entities
+        self.pos = np.stack([entity.state.p_pos for entity in entities]).astype(np.float64)
+        self.vel = np.stack([entity.state.p_vel for entity in entities]).astype(np.float64)
+        for i, entity in enumerate(entities):
+            entity.state.p_pos = self.pos[i]
+            entity.state.p_vel = self.vel[i]
+
+    # agent controls and wall contacts as an (N, D) force array
+    def gather_forces(self):
+        p_force = [None] * len(self.entities)
+        p_force = self.apply_action_force(p_force)
+        if self.walls:
+            for a, entity in enumerate(self.entities):
+                if not entity.movable: continue
+                for wall in self.walls:
+                    wf = self.get_wall_collision_force(entity, wall)
+                    if wf is not None:
+                        p_force[a] = wf if p_force[a] is None else p_force[a] + wf
+        force = np.zeros((len(self.entities), self.dim_p))
+        for i, f in enumerate(p_force):
+            if f is not None:
+                force[i] = f
+        return force
+
+    # update state of the world
+    def step(self):
+        VecWorld.step_worlds([self])
+
+    # step B worlds sharing the same entity layout with one batched kernel call
+    @staticmethod
+    def step_worlds(worlds):
+        world = worlds[0]
+        for w in worlds:
+            # set actions for scripted agents
+            for agent in w.scripted_agents:
+                agent.action = agent.action_callback(agent, w)
+            if w.pos is None:
+                w.bind_state()
+        size, mass, movable, collide, max_speed = world.entity_properties()
+        pos = np.stack([w.pos for w in worlds])
+        vel = np.stack([w.vel for w in worlds])
+        force = np.stack([w.gather_forces() for w in worlds])
+        force += entity_collision_forces(pos, size, mass, movable, collide,
+                                         world.contact_force, world.contact_margin)
+        pos, vel = integrate_entity_state(pos, vel, force, mass, movable, max_speed,
+                                          world.damping, world.dt)
+        for b, w in enumerate(worlds):
+            w.pos[...] = pos[b]
+            w.vel[...] = vel[b]
+            # update agent state
+            for agent in w.agents:
+                w.update_agent_state(agent)
+            # calculate and store distances between all entities
+            if w.cache_dists:
+                w.calculate_distances()
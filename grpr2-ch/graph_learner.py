@@ -0,0 +1,110 @@
+import copy
+import queue
+import threading
+
+import torch
+
+
+class AsyncGraphLearner(object):
+    """Runs `GraphFlows.backward` on a background thread.
+
+    The learner trains its own copy of the graph policy. Update tuples
+    (obs, Q-mean, graphs, log-probs) reach it through a bounded queue, so
+    the agent learners only block when the graph learner is `max_queue`
+    updates behind. After every `publish_interval` updates the new weights
+    are published with an increasing version. `poll` swaps the latest
+    published weights into `graph_policy`, the copy the sampler acts with.
+    The publish slot is guarded by a lock, and the swap itself happens on
+    the caller's thread, between sampler steps.
+
+    TF session runs and torch ops release the GIL, so on a multi-core
+    machine the two learners overlap.
+    """
+
+    _STOP = object()
+
+    def __init__(self, graph_policy, max_queue=4, num_threads=1, publish_interval=1):
+        """
+        Args:
+            graph_policy (`GraphFlows`): The sampler's graph policy. It is
+                only written to by `poll`.
+            max_queue (`int`): Number of pending updates before `submit`
+                blocks.
+            num_threads (`int`): Torch intra-op threads of the learner
+                thread. Set on that thread when it starts.
+            publish_interval (`int`): Updates between two weight publishes.
+        """
+        self.graph_policy = graph_policy
+        graph_policy.erase_cache() # cached activations are not copyable
+        graph_policy.refresh_inference()
+        self._learner = copy.deepcopy(graph_policy)
+        self._learner.trace_act = False
+
+        self.num_threads = num_threads
+        self.publish_interval = publish_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._published = None # (version, weights)
+        self.version = 0 # version of the weights in graph_policy
+        self.n_updates = 0
+        self.last_loss = None
+        self._error = None
+
+        self._thread = threading.Thread(target=self._run, name='graph_learner', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        torch.set_num_threads(self.num_threads)
+        while True:
+            update = self._queue.get()
+            if update is self._STOP:
+                break
+            if self._error is not None:
+                # keep draining so a blocked submit() returns and raises
+                continue
+            try:
+                self.last_loss = self._learner.backward(**update)
+                self.n_updates += 1
+                if self.n_updates % self.publish_interval == 0:
+                    self._publish()
+            except Exception as e:
+                self._error = e
+
+    def _publish(self):
+        weights = self._learner.get_weights()
+        with self._lock:
+            self._published = (self.n_updates, weights)
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError('graph learner thread failed') from self._error
+
+    def submit(self, obs, qs, As, log_As_probs, full_obs=None):
+        """Queue one `GraphFlows.backward` update; blocks while the queue is full."""
+        self._check()
+        self._queue.put(dict(obs=obs, qs=qs, As=As, log_As_probs=log_As_probs, full_obs=full_obs))
+
+    def poll(self):
+        """Swap newly published weights into `graph_policy`.
+
+        Returns:
+            True if the weights changed. Graphs sampled before the swap then
+            carry log-probs of the old weights.
+        """
+        self._check()
+        with self._lock:
+            published, self._published = self._published, None
+        if published is None or published[0] <= self.version:
+            return False
+        self.version, weights = published
+        self.graph_policy.set_weights(weights)
+        return True
+
+    def close(self):
+        """Finish the queued updates, stop the thread and publish the final weights."""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        if self._error is None and self.n_updates > self.version:
+            self._publish()
+        self.poll()
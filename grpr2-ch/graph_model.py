@@ -10,6 +10,8 @@ from torch import nn
 from torch import distributions
 import numbers
 import time
+import warnings
+import copy
 from torch import autograd
 try:
     from agents.nfLayers.neural_net import NeuralNet
@@ -28,15 +30,48 @@ try:
 except:
     from nfLayers import disc_utils
 
+try:
+    from agents import graph_sampling
+except:
+    import graph_sampling
+
+try:
+    from agents import acyclicity
+except:
+    import acyclicity
+
 # set hyparameter
-rho, alpha = 1., 1. # for h func
+rho, alpha = 1., 1. # initial rho and lambda of the acyclicity Lagrangian
 
 NATIVE_GRADIENT = True
+# checkpoint format; 1 (no version stored) predates the XOR coupling
+GRAPH_FORMAT_VERSION = 2
 
 # add coupling flow
 class GraphFlows(nn.Module):
     def __init__(self, n_s=10, n_agent=5, n_step=0, n_n=0, policy_name='lstm', agent_name='graph_player', n_fc=64,
-                 n_lstm=64):
+                 n_lstm=64, entropy_estimator='analytic', sample_num=1000, trace_act=False,
+                 k_neighbors=None, edge_mask=None, pos_index=2, dag=None, dag_order=None,
+                 dag_step_interval=100, dag_rho_max=1e6):
+        """
+        Args:
+            k_neighbors (`int`): Sparse mode. The latent only covers the edges
+                from each agent's `k_neighbors` nearest agents (the agent
+                itself included), by the position at
+                `pos_index:pos_index + 2` of its observation.
+            edge_mask: Sparse mode with a fixed (n_agent, n_agent) 0/1 mask;
+                the latent covers the edges j -> i with `edge_mask[i, j]` set.
+            dag (`str`): Constrain the graphs to be acyclic with the
+                `acyclicity` penalty, computed by 'expm' or 'series' (of
+                order `dag_order`) under an augmented-Lagrangian schedule,
+                stepped every `dag_step_interval` backward passes with rho
+                capped at `dag_rho_max`.
+
+        In sparse mode graphs are edge lists: a bit per candidate edge
+        (`out_size` of them), whose receivers and senders are given by
+        `edge_index`. Without either argument the latent is the dense n x n
+        adjacency matrix.
+        """
         super(GraphFlows, self).__init__()
         self.name = policy_name
         if agent_name is not None:
@@ -46,16 +81,35 @@ class GraphFlows(nn.Module):
         self.batch_size = self.n_step
         # init for flow
         self.nagt = n_agent # number of agents
-        self.use_entropy = True
-        self.use_dag = False
-        self.out_size = n_agent **2 # size of A
+        self.use_entropy = entropy_estimator != 'off'
+        if entropy_estimator not in graph_sampling.ENTROPY_ESTIMATORS:
+            raise ValueError('Unknown entropy estimator: {}'.format(entropy_estimator))
+        self.entropy_estimator = entropy_estimator
+        self.use_dag = dag is not None
+        self.dag = None
+        if self.use_dag:
+            self.dag = acyclicity.AcyclicityConstraint(dag, order=dag_order, rho=rho, lam=alpha,
+                                                     step_interval=dag_step_interval, rho_max=dag_rho_max)
+        self.k_neighbors = None if k_neighbors is None else min(k_neighbors, n_agent)
+        self.pos_index = pos_index
+        self.sparse = self.k_neighbors is not None or edge_mask is not None
+        if self.k_neighbors is not None:
+            self._receivers = torch.arange(n_agent).repeat_interleave(self.k_neighbors)
+            self._senders = None # depend on the positions, see edge_index()
+        elif edge_mask is not None:
+            self._receivers, self._senders = torch.nonzero(torch.as_tensor(np.asarray(edge_mask) > 0), as_tuple=True)
+        if self.sparse:
+            self.out_size = len(self._receivers) # number of candidate edges
+        else:
+            self.out_size = n_agent **2 # size of A
         self.vocab_size = 2 # 0 or 1 for A_ij
-        self.sample_num = 1000
+        self.sample_num = sample_num # graphs per Monte Carlo entropy estimate
 
         # init parameters for distribution
         self.base_logit_probs = torch.tensor(torch.rand(self.out_size, self.vocab_size), requires_grad=True)
 
         n_auxiliary = n_s # dim of auxiliary feature, auxiliary should has same size as input.
+        self.n_s = n_s
 
         self.flow_model = NF(
             n_auxiliary,
@@ -73,47 +127,14 @@ class GraphFlows(nn.Module):
         self.graph_optim = torch.optim.Adam([{'params':self.flow_model.parameters(),'lr':1e-2},
                                              {'params':self.base_logit_probs,'lr':1e-2}], weight_decay=1e-2)
 
+        # inference path used by act()
+        self.trace_act = trace_act
+        self._act_flows = {} # batch size -> traced flow of the inference copy
+        self._act_noise = {} # batch size -> Gumbel noise buffer
 
-    def sample_graphs_from_base(self, batch_size, base_log):
 
-        def sample_gumbel(n, k):
-            unif = torch.distributions.Uniform(0, 1).sample((n, k))
-            g = -torch.log(-torch.log(unif))
-            return g
-
-        def sample_gumbel_softmax(pi, n, temperature):
-            k = len(pi)
-            g = sample_gumbel(n, k)
-            h = (g + torch.log(pi)) / temperature
-            h_max = h.max(dim=1, keepdim=True)[0]
-            h = h - h_max
-            cache = torch.exp(h)
-            y = cache / cache.sum(dim=-1, keepdim=True)
-            return y
-
-        softmax_func = torch.nn.Softmax(dim=1)
-        pi = softmax_func(base_log)
-        outs = []
-        for idx in range(len(pi)):
-            y = sample_gumbel_softmax(pi[idx], batch_size, temperature=1.)
-            outs.append(y.unsqueeze(0))
-        b = torch.cat(outs, dim=0)
-        out = b.transpose(0, 1)
-        out1 = torch.argmax(out, dim=2)
-
-        def sample_gumbel_softmax_batch(pi, n, temperature):
-            k = len(pi[0])
-            g = sample_gumbel(n * len(pi), k).reshape(n, len(pi), k)
-            h = (g + torch.log(pi)) / temperature
-            h_max = h.max(dim=2, keepdim=True)[0]
-            h = h - h_max
-            cache = torch.exp(h)
-            y = cache / cache.sum(dim=-1, keepdim=True)
-            return y
-
-        out = sample_gumbel_softmax_batch(pi, batch_size, temperature=1.)
-        out = torch.argmax(out, dim=2)
-        return out
+    def sample_graphs_from_base(self, batch_size, base_log):
+        return graph_sampling.sample_graphs(base_log, batch_size)
 
     
     def _encode_ob(self, ob):
@@ -121,75 +142,241 @@ class GraphFlows(nn.Module):
 
 
     def save(self, path):
-        torch.save(self.state_dict(), path)
+        state = self.state_dict()
+        state['format_version'] = torch.tensor(GRAPH_FORMAT_VERSION)
+        torch.save(state, path)
 
         
     def load(self, path):
-        self.load_state_dict(torch.load(path))
+        state = torch.load(path)
+        version = int(state.pop('format_version', 1))
+        if version < GRAPH_FORMAT_VERSION:
+            warnings.warn('{} was saved with graph format {} (current: {}); its discrete couplings '
+                          'mixed the edges differently, so the loaded policy will not sample the '
+                          'graphs it was trained on'.format(path, version, GRAPH_FORMAT_VERSION))
+        self.load_state_dict(state)
+        self.refresh_inference()
+
+
+    def get_weights(self):
+        """Detached copy of the module state plus the base logits, which are
+        not part of `state_dict`."""
+        state = {name: value.detach().clone() for name, value in self.state_dict().items()}
+        return state, self.base_logit_probs.detach().clone()
+
+
+    def set_weights(self, weights):
+        """Load weights from `get_weights` in place."""
+        state, base_logit_probs = weights
+        self.load_state_dict(state)
+        with torch.no_grad():
+            self.base_logit_probs.copy_(base_logit_probs)
+        self.refresh_inference()
+
+
+    def erase_cache(self):
+        """Drop the flow's cached activations and the tensors kept from the
+        last sampling or update; needed before the module is deep-copied."""
+        self.flow_model.erase_cache()
+        self.prior = self.xs = self.base_log_probs_sm = None
+
+
+    def refresh_inference(self):
+        """Drop the traced inference flows; they are rebuilt from the current
+        weights on the next `act`."""
+        self._act_flows = {}
+
+
+    def _act_flow(self, batch_size):
+        if not self.trace_act:
+            def run(obs, prior):
+                self.flow_model.set_auxiliary(obs)
+                return self.flow_model.forward(prior)
+            return run
+        if batch_size not in self._act_flows:
+            # trace a frozen copy: the trace bakes the weights in as constants
+            self.flow_model.erase_cache() # cached activations are not copyable
+            flow = copy.deepcopy(self.flow_model).requires_grad_(False)
+            def run(obs, prior):
+                flow.set_auxiliary(obs)
+                return flow.forward(prior)
+            with torch.no_grad():
+                self._act_flows[batch_size] = torch.jit.trace(
+                    run, (torch.zeros(batch_size, self.n_s), torch.zeros(batch_size, self.out_size)),
+                    check_trace=False)
+        return self._act_flows[batch_size]
+
+
+    def edge_index(self, obs):
+        """Candidate edges of the sparse mode for a (B, n_s) batch.
+
+        Returns:
+            Senders (B, out_size) and receivers (out_size,), as long tensors.
+            Edge e of a graph carries the state of agent `senders[:, e]` to
+            agent `receivers[e]`.
+        """
+        batch_size = obs.shape[0]
+        if self.k_neighbors is None:
+            return self._senders.expand(batch_size, -1), self._receivers
+        pos = obs.reshape(batch_size, self.nagt, -1)[..., self.pos_index:self.pos_index + 2]
+        senders = torch.topk(torch.cdist(pos, pos), self.k_neighbors, dim=-1, largest=False).indices
+        return senders.reshape(batch_size, -1), self._receivers
+
+
+    def aggregate(self, edges, senders, receivers, hidden_state):
+        """Sparse counterpart of A @ hidden_state: gather the senders' states,
+        weight them by the edge bits and scatter-add them into the receivers."""
+        dim = hidden_state.shape[-1]
+        gathered = torch.gather(hidden_state, 1, senders.unsqueeze(-1).expand(-1, -1, dim))
+        messages = hidden_state.new_zeros(hidden_state.shape[0], self.nagt, dim)
+        return messages.index_add_(1, receivers, gathered * edges.unsqueeze(-1))
+
+
+    def dense_adjacency(self, obs, edges):
+        """(B, n, n) adjacency matrices of sparse-mode edge bits, for the
+        raw (B, n_s) joint observations `obs` the graphs were sampled from."""
+        obs = torch.as_tensor(obs, dtype=torch.float32).reshape(-1, self.n_s)
+        edges = torch.as_tensor(edges, dtype=torch.float32).reshape(-1, self.out_size)
+        senders, receivers = self.edge_index(obs)
+        As = torch.zeros(obs.shape[0], self.nagt * self.nagt)
+        return As.scatter_(1, receivers * self.nagt + senders, edges).reshape(-1, self.nagt, self.nagt)
+
+
+    def act(self, obs, hidden_state=None):
+        """Inference-only graph sampling for the actors.
+
+        Same sampling as `forward_batch`, but run under
+        `torch.inference_mode` (optionally through a traced copy of the flow,
+        see `trace_act`) and returned as NumPy arrays.
+
+        Args:
+            obs: (B, n_s) joint observations.
+            hidden_state: Optional (B, n, d) per-agent states to aggregate.
+
+        Returns:
+            Adjacency matrices (B, n, n), log-probs (B,) and, if
+            `hidden_state` is given, the messages A @ hidden_state (B, n, d),
+            else None. In sparse mode the graphs are the (B, out_size) edge
+            bits and the messages are aggregated over the edge list.
+        """
+        with torch.inference_mode():
+            obs = torch.as_tensor(np.asarray(obs, dtype=np.float32)).reshape(-1, self.n_s)
+            batch_size = obs.shape[0]
+            if batch_size not in self._act_noise:
+                self._act_noise[batch_size] = torch.empty(batch_size, self.out_size, self.vocab_size)
+            prior = graph_sampling.sample_graphs(self.base_logit_probs, batch_size, noise=self._act_noise[batch_size])
+            xs = self._act_flow(batch_size)(obs, prior.float()).float()
+            log_As_probs = graph_sampling.graph_log_prob(self.base_logit_probs, prior)
+            messages = None
+            if hidden_state is not None:
+                hidden_state = torch.as_tensor(np.asarray(hidden_state, dtype=np.float32)).reshape(batch_size, self.nagt, -1)
+            if self.sparse:
+                As = xs
+                if hidden_state is not None:
+                    senders, receivers = self.edge_index(obs)
+                    messages = self.aggregate(As, senders, receivers, hidden_state).numpy()
+            else:
+                As = xs.reshape(batch_size, self.nagt, self.nagt)
+                if hidden_state is not None:
+                    messages = torch.matmul(As, hidden_state).numpy()
+            return As.numpy(), log_As_probs.numpy(), messages
 
         
     def forward(self,ob, *_args, **_kwargs):
+        """Sample adjacency matrices for joint observations.
 
+        `ob` is a single observation (a 1-D array, or a list holding one),
+        which gives an (n, n) matrix and a (1,) log-prob, or a (B, n_s)
+        batch, which is passed to `forward_batch`.
+        """
         if isinstance(ob, list):
-            ob1=ob[0]
+            single = len(ob) == 1
+            ob = np.stack(ob)
         else:
-            ob1 = ob
-        ob2 = torch.from_numpy(ob1).float()
-        self.flow_model.set_auxiliary(ob2)
-        self.prior = self.sample_graphs_from_base(len(ob), self.base_logit_probs)
-        self.xs = self.flow_model.forward(self.prior).squeeze()
+            single = ob.ndim == 1
+        As, log_As_probs = self.forward_batch(ob)
+        if single:
+            return As[0], log_As_probs
+        return As, log_As_probs
+
 
-        priorv =self.prior.reshape(1*self.nagt*self.nagt).long() # convert to int64
-        priorv = torch.nn.functional.one_hot(priorv, num_classes=2).reshape(1, self.nagt*self.nagt,2)
+    def forward_batch(self, obs):
+        """Batch-first sampling: (B, n_s) observations to (B, n, n) adjacency
+        matrices (sparse mode: (B, out_size) edge bits) and (B,) log-probs of
+        their base samples."""
+        if not isinstance(obs, torch.Tensor):
+            obs = torch.from_numpy(np.asarray(obs))
+        obs = obs.float().reshape(-1, self.n_s)
+        batch_size = obs.shape[0]
+        self.flow_model.set_auxiliary(obs)
+        self.prior = self.sample_graphs_from_base(batch_size, self.base_logit_probs)
+        self.xs = self.flow_model.forward(self.prior)
+
+        priorv =self.prior.reshape(-1).long() # convert to int64
+        priorv = torch.nn.functional.one_hot(priorv, num_classes=2).reshape(batch_size, self.out_size,2)
 
         self.base_log_probs_sm = torch.nn.functional.log_softmax(self.base_logit_probs, dim=-1)
         log_As_probs = priorv * self.base_log_probs_sm # zs are onehot so zero out all other logprobs.
         log_As_probs = th.sum(log_As_probs, dim=(1,2))  
 
-        As = self.xs.reshape([-1,self.nagt, self.nagt]).squeeze().float()
+        if self.sparse:
+            As = self.xs.float()
+        else:
+            As = self.xs.reshape([batch_size, self.nagt, self.nagt]).float()
 
         return As, log_As_probs
 
 
-    def backward(self, obs, qs, As, log_As_probs, nactions=None, acts=None, dones=None, Rs=None, Advs=None,e_coef=5e-3, v_coef=None, summary_writer=None, global_step=None,nbatch=None):
+    def backward(self, obs, qs, As, log_As_probs, nactions=None, acts=None, dones=None, Rs=None, Advs=None,e_coef=5e-3, v_coef=None, summary_writer=None, global_step=None,nbatch=None, full_obs=None):
 
         # if use auxiliary feature
         qs = torch.from_numpy(np.array(qs)).float()
 
         As_tensor = torch.flatten(torch.from_numpy(As).float(),start_dim=1)
         
-        log_As_probs = torch.reshape(torch.from_numpy(log_As_probs).float(),(-1,))
+        log_As_probs = torch.reshape(torch.from_numpy(log_As_probs).float(),(-1,1))
 
-        self.flow_model.set_auxiliary(torch.from_numpy(obs).float())
+        obs = torch.from_numpy(obs).float()
+        self.flow_model.set_auxiliary(obs)
 
         zs = self.flow_model.backward(As_tensor).squeeze()
 
-        zs = torch.cat([zs.unsqueeze(-1), (1 - zs).unsqueeze(-1)], dim=-1).reshape(self.batch_size, self.nagt*self.nagt,2)
+        zs = torch.cat([zs.unsqueeze(-1), (1 - zs).unsqueeze(-1)], dim=-1).reshape(-1, self.out_size,2)
         self.base_log_probs_sm = torch.nn.functional.log_softmax(self.base_logit_probs, dim=-1)
         logprobs = zs * self.base_log_probs_sm  # zs are onehot so zero out all other logprobs.
         logprobs = th.sum(logprobs, dim=(1, 2))
 
         logprobs = torch.reshape(logprobs,(-1,1))
 
-        rho_loss = -((logprobs-log_As_probs).exp() * qs).mean()
+        ratio = (logprobs-log_As_probs).exp()
+        rho_loss = -(ratio * qs).mean()
 
         loss = rho_loss
         if self.use_entropy:
-            sample_As = self.sample_graphs_from_base(self.sample_num, self.base_logit_probs)
-            sample_Asv = sample_As.reshape(self.sample_num * self.nagt * self.nagt).long()  # convert to int64
-            sample_Asv = torch.nn.functional.one_hot(sample_Asv, num_classes=2).reshape(self.sample_num,
-                                                                                        self.nagt * self.nagt, 2)
-            entropy_loss = (logprobs).mean() * e_coef
+            entropy = graph_sampling.base_entropy(self.base_logit_probs, self.entropy_estimator, self.sample_num)
+            entropy_loss = -entropy * e_coef
             loss += entropy_loss
 
         if self.use_dag:
-            h_val = self.h_func(As)
-            penalty = 0.5 * rho * h_val * h_val + alpha * h_val
-            loss += penalty
+            if self.sparse:
+                # the k-neighbour senders come from the raw positions the
+                # graphs were sampled from, not from the replayed messages
+                if self.k_neighbors is not None and full_obs is None:
+                    raise ValueError('The k-neighbour acyclicity penalty needs the full_obs of the graphs')
+                As_dense = self.dense_adjacency(obs if full_obs is None else full_obs, As_tensor)
+            else:
+                As_dense = As_tensor.reshape(-1, self.nagt, self.nagt)
+            # the graphs are data, so the expected h under the current
+            # policy is weighted by the same ratio as the Q term
+            h_val = self.dag.h(As_dense)
+            loss += self.dag((ratio.reshape(-1) * h_val).mean())
 
         loss.backward()
+        if self.use_dag:
+            self.dag.step()
         self.graph_optim.step()
         self.graph_optim.zero_grad()
+        self.refresh_inference()
 
         for params in self.parameters():
             pass
@@ -201,16 +388,11 @@ class GraphFlows(nn.Module):
 
 
     def h_func(self, As):
-        """Constrain 2-norm-squared of fc1 weights along m1 dim to be a DAG"""
-        # batch wise loss
-        M0 = th.eye(self.nagt)
-        M0 = M0.reshape((1, self.nagt, self.nagt))
-        M0 = M0.repeat(self.n_step, 1, 1)
-        M = M0 + th.from_numpy(As)/self.nagt
-        E =th.matrix_power(M, self.nagt - 1)
-        hs = ((th.transpose(E, 1, 2)*M).sum() - self.nagt*self.n_step)/self.nagt
-        # pdb.set_trace()
-        return hs
+        """Mean acyclicity h(A) of a batch of (n, n) graphs, see `acyclicity`"""
+        As = torch.as_tensor(As, dtype=torch.float32).reshape(-1, self.nagt, self.nagt)
+        if self.use_dag:
+            return self.dag.h(As).mean()
+        return acyclicity.acyclicity(As).mean()
 
 
 class EraseCache():
@@ -475,6 +657,7 @@ class BinActive(torch.autograd.Function):
     
 class DiscreteCouplingFlow(AbstractInvertibleLayer):
     invertible = True
+    vocab_size = 2 # A_ij is 0 or 1, so the couplings are XORs
 
     def __init__(self,
                  input_size,
@@ -563,15 +746,9 @@ class DiscreteCouplingFlow(AbstractInvertibleLayer):
                 t = t.detach()
             self.set_gradient_mode_transform(True)
 
-        input_by  = 1. - input_b
-        xb = th.cat([input_b.unsqueeze(-1), input_by.unsqueeze(-1)], dim = -1)
-        fy = 1. - f
-        mxa = th.cat([f.unsqueeze(-1), fy.unsqueeze(-1)], dim=-1)
-
-        mix_output_b = disc_utils.one_hot_add(xb, mxa)
-        mix_output_b = mix_output_b[:,:, 1]
+        mix_output_b = disc_utils.binary_add(input_b, f)
 
-        output = torch.cat([input_a, mix_output_b.reshape(input_a.shape)], dim=-1)
+        output = torch.cat([input_a, mix_output_b.reshape(input_b.shape)], dim=-1)
 
         output = output[..., self.inverse_idx]
 
@@ -606,14 +783,7 @@ class DiscreteCouplingFlow(AbstractInvertibleLayer):
                 t = t.detach()
             self.set_gradient_mode_transform(True)
 
-        output_by = 1. - output_b
-        yb = th.cat([output_b.unsqueeze(-1), output_by.unsqueeze(-1)], dim=-1)
-        fy = 1. - f
-        mya = th.cat([f.unsqueeze(-1), fy.unsqueeze(-1)], dim=-1)
-
-        mix_input_b = disc_utils.one_hot_minus(yb, mya)
-
-        mix_input_b = mix_input_b[:,:,-1]
+        mix_input_b = disc_utils.binary_minus(output_b, f)
 
         input = torch.cat([input_a, mix_input_b], dim=-1)
         input = input[..., self.inverse_idx]
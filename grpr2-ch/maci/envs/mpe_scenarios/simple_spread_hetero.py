@@ -1,11 +1,11 @@
 import numpy as np
-from multiagent.core import World, Agent, Landmark
+from multiagent.core import World, VecWorld, Agent, Landmark
 from multiagent.scenario import BaseScenario
 
 
 class Scenario(BaseScenario):
-    def make_world(self):
-        world = World()
+    def make_world(self, vectorized=False):
+        world = VecWorld() if vectorized else World()
         # set any world properties first
         world.dim_c = 0
         num_agents = 8
@@ -88,6 +88,18 @@ class Scenario(BaseScenario):
                     rew -= 1
         return rew
 
+    def rewards_all(self, world):
+        # rewards of all agents from one agent-landmark and one agent-agent distance matrix
+        agent_pos = np.array([a.state.p_pos for a in world.agents])
+        landmark_pos = np.array([l.state.p_pos for l in world.landmarks])
+        landmark_dists = np.sqrt(np.sum(np.square(agent_pos[:, None, :] - landmark_pos[None, :, :]), axis=-1))
+        rew = -np.sum(np.min(landmark_dists, axis=0))
+        agent_dists = np.sqrt(np.sum(np.square(agent_pos[:, None, :] - agent_pos[None, :, :]), axis=-1))
+        size = np.array([a.size for a in world.agents])
+        collide = np.array([a.collide for a in world.agents])
+        collisions = np.sum(agent_dists < size[:, None] + size[None, :], axis=1)
+        return rew - np.where(collide, collisions, 0)
+
     def observation(self, agent, world):
 
         # get positions of all entities in this agent's reference frame
@@ -116,3 +128,18 @@ class Scenario(BaseScenario):
             # return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + entity_pos + other_pos)
         # else:
         return np.concatenate([agent.state.p_vel] + [agent.state.p_pos] + [nearest_entity_pos] + [nearest_other_pos])
+
+    def observations_all(self, world):
+        # observations of all agents stacked as an (agent_num, obs_dim) array
+        agent_pos = np.array([a.state.p_pos for a in world.agents])
+        agent_vel = np.array([a.state.p_vel for a in world.agents])
+        landmark_pos = np.array([l.state.p_pos for l in world.landmarks])
+        idx = np.arange(len(world.agents))
+        landmark_rel = landmark_pos[None, :, :] - agent_pos[:, None, :]
+        landmark_dists = np.sqrt(np.sum(np.square(landmark_rel), axis=-1))
+        nearest_entity_pos = landmark_rel[idx, np.argmin(landmark_dists, axis=1)]
+        other_rel = agent_pos[None, :, :] - agent_pos[:, None, :]
+        other_dists = np.sqrt(np.sum(np.square(other_rel), axis=-1))
+        other_dists[idx, idx] = np.inf
+        nearest_other_pos = other_rel[idx, np.argmin(other_dists, axis=1)]
+        return np.concatenate([agent_vel, agent_pos, nearest_entity_pos, nearest_other_pos], axis=1)
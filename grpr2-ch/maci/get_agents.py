@@ -1,7 +1,9 @@
+from functools import partial
+
 import numpy as np
 import tensorflow as tf
 from maci.learners import REGMAAC, MADDPG
-from maci.misc.kernel import adaptive_isotropic_gaussian_kernel
+from maci.misc.kernel import adaptive_isotropic_gaussian_kernel, KERNEL_FNS
 from maci.replay_buffers import SimpleReplayBuffer
 from maci.value_functions.sq_value_function import NNQFunction, NNJointQFunction
 from maci.value_functions.attention_critic import AttentionCritic
@@ -98,8 +100,14 @@ def get_level_k_policy(env, k, M, agent_id, u_range, opponent_conditional_policy
     return k_policy, target_k_policy
 
 
-def regma_ac_agent(model_name, agent_num, i, env, M, u_range, base_kwargs, k=0, g=False, mu=1.5, game_name='matrix', aux=True, attend_heads=4):
+def regma_ac_agent(model_name, agent_num, i, env, M, u_range, base_kwargs, k=0, g=False, mu=1.5, game_name='matrix', aux=True, attend_heads=4, pool=None, pool_kwargs=None,
+                   kernel='exact', kernel_n_particles=32, kernel_median_samples=None, xla=False):
     joint = False
+    kernel_fn = KERNEL_FNS[kernel]
+    if kernel_median_samples is not None:
+        if kernel == 'exact':
+            raise ValueError('the exact kernel always takes the full median')
+        kernel_fn = partial(kernel_fn, median_samples=kernel_median_samples)
     # squash = True
     # squash_func = tf.tanh
     # correct_tanh = True
@@ -110,7 +118,9 @@ def regma_ac_agent(model_name, agent_num, i, env, M, u_range, base_kwargs, k=0,
     squash_func = tf.nn.softmax
     correct_tanh = False
 
-    pool = SimpleReplayBuffer(env.env_specs, agent_num, max_replay_buffer_size=1e4, joint=joint, agent_id=i)
+    if pool is None:
+        pool = SimpleReplayBuffer(env.env_specs, agent_num, max_replay_buffer_size=1e4, joint=joint, agent_id=i,
+                                  **(pool_kwargs or {}))
 
     opponent_conditional_policy = StochasticNNConditionalPolicy(env.env_specs,
                                                        hidden_layer_sizes=(M, M),
@@ -177,8 +187,8 @@ def regma_ac_agent(model_name, agent_num, i, env, M, u_range, base_kwargs, k=0,
         qf_lr=3e-4,
         joint=False,
         value_n_particles=16,
-        kernel_fn=adaptive_isotropic_gaussian_kernel,
-        kernel_n_particles=32,
+        kernel_fn=kernel_fn,
+        kernel_n_particles=kernel_n_particles,
         kernel_update_ratio=0.5,
         td_target_update_interval=5,
         discount=0.99,
@@ -186,11 +196,12 @@ def regma_ac_agent(model_name, agent_num, i, env, M, u_range, base_kwargs, k=0,
         tau=0.01,
         save_full_state=False,
         k=k,
-        aux=aux)
+        aux=aux,
+        xla=xla)
     return agent
 
 
-def ddpg_agent(joint, agent_num, opponent_modelling, model_name, i, env, M, u_range, base_kwargs, game_name='matrix'):
+def ddpg_agent(joint, agent_num, opponent_modelling, model_name, i, env, M, u_range, base_kwargs, game_name='matrix', pool=None, pool_kwargs=None):
     # joint = True
     # opponent_modelling = False
     print(model_name)
@@ -203,7 +214,9 @@ def ddpg_agent(joint, agent_num, opponent_modelling, model_name, i, env, M, u_ra
         sampling = True
 
     print(joint, opponent_modelling)
-    pool = SimpleReplayBuffer(env.env_specs, agent_num, max_replay_buffer_size=1e4, joint=joint, agent_id=i)
+    if pool is None:
+        pool = SimpleReplayBuffer(env.env_specs, agent_num, max_replay_buffer_size=1e4, joint=joint, agent_id=i,
+                                  **(pool_kwargs or {}))
 
     
         
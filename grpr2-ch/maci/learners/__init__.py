@@ -2,4 +2,6 @@
 # from .diayn import DIAYN
 # from .masql import MASQL
 from .maddpg import MADDPG
-from .regma_ac import REGMAAC
\ No newline at end of file
+from .regma_ac import REGMAAC
+from .joint_trainer import JointTrainer
+from .parallel_trainer import ParallelTrainer
\ No newline at end of file
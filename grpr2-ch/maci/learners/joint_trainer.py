@@ -0,0 +1,80 @@
+import numpy as np
+import tensorflow as tf
+
+from maci.misc import tf_utils
+
+from .regma_ac import REGMAAC
+
+
+class JointTrainer(object):
+    """Fused multi-agent training step.
+
+    Collects the `_training_ops`, target ops and Q-mean tensors of all agents
+    so that one update of the whole team costs a single `Session.run` with one
+    combined feed dict, instead of several launches per agent.
+    """
+
+    def __init__(self, agents):
+        """
+        Args:
+            agents (`list`): Initialized learners (`REGMAAC` or `MADDPG`).
+                Their graphs only touch their own variables, so the training
+                ops of different agents can run in the same session call.
+        """
+        self._agents = agents
+        self._sess = tf_utils.get_default_session()
+
+        training_ops = [op for agent in agents for op in agent._training_ops]
+        self._train_op = tf.group(*training_ops, name='joint_training_op')
+
+        # Target updates must read the freshly trained source variables. A
+        # control dependency only orders ops created under it, so each
+        # agent's soft update is rebuilt here, reads and assigns included,
+        # rather than grouping the agent's own (unordered) target ops.
+        self._target_ops = []
+        with tf.control_dependencies([self._train_op]):
+            for agent in agents:
+                if agent._train_qf and len(agent._target_params) > 0:
+                    self._target_ops.append(tf_utils.polyak_update(
+                        agent._target_params, agent._source_params, agent._tau,
+                        name='joint_target_update_agent_{}'.format(agent._agent_id)))
+                else:
+                    self._target_ops.append(None)
+
+        self._q_means = [agent._q_mean for agent in agents]
+
+    def _get_feed_dict(self, batch_n, annealing):
+        feeds = {}
+        for agent, batch in zip(self._agents, batch_n):
+            if isinstance(agent, REGMAAC):
+                feeds.update(agent._get_feed_dict(batch, annealing))
+            else:
+                feeds.update(agent._get_feed_dict(batch))
+        return feeds
+
+    def do_training(self, iteration, batch_n, annealing=1., q_mean=False):
+        """Run one update of every agent in a single `Session.run`.
+
+        Args:
+            iteration (`int`): Training iteration, used for the target update
+                interval of each agent.
+            batch_n (`list`): Per-agent batches, as passed to `_do_training`.
+            annealing (`float`): Annealing value fed to `REGMAAC` agents.
+            q_mean (`bool`): Whether to also fetch the per-agent Q-mean
+                diagnostic. It is evaluated in a second run, after the update
+                and with annealing 1, so it equals `ret_q_mean` on the
+                trained agents.
+
+        Returns:
+            `np.ndarray` of per-agent Q-means if `q_mean` is set, else None.
+        """
+        fetches = [self._train_op]
+        for agent, target_op in zip(self._agents, self._target_ops):
+            if target_op is not None and iteration % agent._qf_target_update_interval == 0:
+                fetches.append(target_op)
+
+        self._sess.run(fetches, self._get_feed_dict(batch_n, annealing))
+
+        if q_mean:
+            return np.array(self._sess.run(self._q_means, self._get_feed_dict(batch_n, 1.)))
+        return None
@@ -4,7 +4,7 @@ import tensorflow as tf
 from maci.misc import logger
 from maci.misc.overrides import overrides
 
-from maci.misc.kernel import adaptive_isotropic_gaussian_kernel
+from maci.misc.kernel import adaptive_isotropic_gaussian_kernel, stein_variational_gradient
 from maci.misc import tf_utils
 
 from .base import MARLAlgorithm
@@ -244,19 +244,14 @@ class MASQL(MARLAlgorithm):
         log_p = svgd_target_values + squash_correction
 
         grad_log_p = tf.gradients(log_p, fixed_actions)[0]
-        grad_log_p = tf.expand_dims(grad_log_p, axis=2)
         grad_log_p = tf.stop_gradient(grad_log_p)
-        assert_shape(grad_log_p, [None, n_fixed_actions, 1, self._action_dim + self._opponent_action_dim])
+        assert_shape(grad_log_p, [None, n_fixed_actions, self._action_dim + self._opponent_action_dim])
 
         kernel_dict = self._kernel_fn(xs=fixed_actions, ys=updated_actions)
 
-        # Kernel function in Equation 13:
-        kappa = tf.expand_dims(kernel_dict["output"], dim=3)
-        assert_shape(kappa, [None, n_fixed_actions, n_updated_actions, 1])
-
-        # Stein Variational Gradient in Equation 13:
-        action_gradients = tf.reduce_mean(
-            kappa * grad_log_p + kernel_dict["gradient"], reduction_indices=1)
+        # Stein Variational Gradient in Equation 13, with the kernel
+        # function of Equation 13 inside:
+        action_gradients = stein_variational_gradient(kernel_dict, grad_log_p)
         assert_shape(action_gradients,
                      [None, n_updated_actions, self._action_dim + self._opponent_action_dim])
 
@@ -287,8 +282,8 @@ class MASQL(MARLAlgorithm):
         target_params = self.target_qf.get_params_internal()
 
         self._target_ops = [
-            tf.assign(target, (1 - self._tau) * target + self._tau * source)
-            for target, source in zip(target_params, source_params)
+            tf_utils.polyak_update(target_params, source_params, self._tau,
+                                   name='target_update_agent_{}'.format(self.agent_id))
         ]
 
     # TODO: do not pass, policy, and pool to `__init__` directly.
@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+from maci.misc import tf_utils
+
+from .regma_ac import REGMAAC
+
+
+class ParallelTrainer(object):
+    """Multi-agent training step with the per-agent updates run concurrently.
+
+    Every agent keeps its own `Session.run` of its `_training_ops`. The runs
+    of the different agents are issued from a thread pool. `Session.run`
+    releases the GIL, so they overlap given enough inter-op threads in the
+    session (see `tf_utils.make_session`). The update stays in lockstep:
+    the target networks are only synced after every agent has finished
+    its update, in one run for the whole team.
+    """
+
+    def __init__(self, agents, num_threads=None):
+        """
+        Args:
+            agents (`list`): Initialized learners (`REGMAAC` or `MADDPG`).
+                Their training ops only touch their own variables, so they
+                can run concurrently.
+            num_threads (`int`): Size of the dispatch pool, one thread per
+                agent by default.
+        """
+        self._agents = agents
+        self._sess = tf_utils.get_default_session()
+        self._pool = ThreadPoolExecutor(max_workers=num_threads or len(agents))
+        self._target_ops = []
+        for agent in agents:
+            if agent._train_qf and len(agent._target_ops) > 0:
+                self._target_ops.append(tf.group(*agent._target_ops))
+            else:
+                self._target_ops.append(None)
+
+    def _train_agent(self, agent, batch, annealing):
+        if isinstance(agent, REGMAAC):
+            feed_dict = agent._get_feed_dict(batch, annealing)
+        else:
+            feed_dict = agent._get_feed_dict(batch)
+        agent._sess.run(agent._training_ops, feed_dict)
+
+    def do_training(self, iteration, batch_n, annealing=1., q_mean=False):
+        """Update every agent concurrently, then sync the due target networks.
+
+        Takes the same arguments and returns the same Q-means as
+        `JointTrainer.do_training`.
+        """
+        futures = [self._pool.submit(self._train_agent, agent, batch, annealing)
+                   for agent, batch in zip(self._agents, batch_n)]
+        for future in futures:
+            future.result()
+
+        target_ops = [target_op for agent, target_op in zip(self._agents, self._target_ops)
+                      if target_op is not None and iteration % agent._qf_target_update_interval == 0]
+        if len(target_ops) > 0:
+            self._sess.run(target_ops)
+
+        if q_mean:
+            return np.array([agent.ret_q_mean(batch) for agent, batch in zip(self._agents, batch_n)])
+        return None
+
+    def close(self):
+        self._pool.shutdown()
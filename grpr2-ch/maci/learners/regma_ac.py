@@ -1,10 +1,12 @@
+from contextlib import nullcontext
+
 import numpy as np
 import tensorflow as tf
 
 from maci.misc import logger
 from maci.misc.overrides import overrides
 
-from maci.misc.kernel import adaptive_isotropic_gaussian_kernel
+from maci.misc.kernel import adaptive_isotropic_gaussian_kernel, stein_variational_gradient
 from maci.misc import tf_utils
 
 from .base import MARLAlgorithm
@@ -52,7 +54,8 @@ class REGMAAC(MARLAlgorithm):
             opponent_action_range=None,
             opponent_action_range_normalize=True,
             k=0,
-            aux=True
+            aux=True,
+            xla=False
     ):
         super(REGMAAC, self).__init__(**base_kwargs)
 
@@ -71,6 +74,7 @@ class REGMAAC(MARLAlgorithm):
         self.opponent_action_range_normalize = opponent_action_range_normalize
         self._k = k
         self._aux = aux
+        self._xla = xla
 
         self._agent_id = agent_id
 
@@ -100,11 +104,15 @@ class REGMAAC(MARLAlgorithm):
 
         self._training_ops = []
         self._target_ops = []
+        # (target, source) variables of the soft update, in matching order
+        self._target_params = []
+        self._source_params = []
 
-        self._create_q_update()
-        self._create_conditional_policy_svgd_update()
-        self._create_p_update()
-        self._create_target_ops()
+        with self._update_scope():
+            self._create_q_update()
+            self._create_conditional_policy_svgd_update()
+            self._create_p_update()
+            self._create_target_ops()
 
         if use_saved_qf:
             saved_qf_params = qf.get_param_values()
@@ -119,6 +127,20 @@ class REGMAAC(MARLAlgorithm):
         if use_saved_policy:
             self.policy.set_param_values(saved_policy_params)
 
+    def _update_scope(self):
+        """Scope the update ops are built in.
+
+        With `xla`, the whole update (critic TD, level-k policy gradient,
+        conditional SVGD and target update, with their Adam steps) is built
+        in an XLA JIT scope. The elementwise ops of the small MLPs are then
+        fused into compiled clusters, which also run on CPU. Stateful random
+        ops are left to the TF kernels, so the sampled actions are unchanged
+        (see `tests/test_regma_ac_xla.py`).
+        """
+        if self._xla:
+            return tf.xla.experimental.jit_scope(compile_ops=True, separate_compiled_gradients=False)
+        return nullcontext()
+
     def _create_placeholders(self):
         """Create all necessary placeholders."""
 
@@ -319,6 +341,8 @@ class REGMAAC(MARLAlgorithm):
                 pg_loss += tf.reduce_mean(q_k_2 - q_k)
 
         self._pg_loss = tf.stop_gradient(pg_loss)
+        # Q-mean diagnostic, built once so `ret_q_mean` does not add ops to the graph
+        self._q_mean = tf.identity(self._pg_loss, name='q_mean_agent_{}'.format(self._agent_id))
         # todo add level k Q loss:
 
 
@@ -382,19 +406,13 @@ class REGMAAC(MARLAlgorithm):
             log_p = svgd_target_values + squash_correction
     
             grad_log_p = tf.gradients(log_p, fixed_actions)[0]
-            grad_log_p = tf.expand_dims(grad_log_p, axis=2)
             grad_log_p = tf.stop_gradient(grad_log_p)
-            assert_shape(grad_log_p, [None, n_fixed_actions, 1, self._opponent_action_dim])
+            assert_shape(grad_log_p, [None, n_fixed_actions, self._opponent_action_dim])
     
             kernel_dict = self._kernel_fn(xs=fixed_actions, ys=updated_actions)
     
-            # Kernel function:
-            kappa = tf.expand_dims(kernel_dict["output"], axis=3)
-            assert_shape(kappa, [None, n_fixed_actions, n_updated_actions, 1])
-    
             # Stein Variational Gradient:
-            action_gradients = tf.reduce_mean(
-                kappa * grad_log_p + kernel_dict["gradient"], axis=1)
+            action_gradients = stein_variational_gradient(kernel_dict, grad_log_p)
             assert_shape(action_gradients,
                          [None, n_updated_actions, self._opponent_action_dim])
     
@@ -426,13 +444,14 @@ class REGMAAC(MARLAlgorithm):
         source_p_params = self._policy.get_params_internal()
         target_p_params = self._target_policy.get_params_internal()
 
+        self._target_params = target_q_params + target_p_params
+        self._source_params = source_q_params + source_p_params
+
+        # one fused soft update of the Q-function and policy per agent
         self._target_ops = [
-                               tf.compat.v1.assign(target, (1 - self._tau) * target + self._tau * source)
-                               for target, source in zip(target_q_params, source_q_params)
-                           ] + [
-                               tf.compat.v1.assign(target, (1 - self._tau) * target + self._tau * source)
-                               for target, source in zip(target_p_params, source_p_params)
-                           ]
+            tf_utils.polyak_update(self._target_params, self._source_params,
+                                   self._tau, name='target_update_agent_{}'.format(self._agent_id))
+        ]
 
     # TODO: do not pass, policy, and pool to `__init__` directly.
     def train(self):
@@ -496,7 +515,7 @@ class REGMAAC(MARLAlgorithm):
         """
 
         feeds = self._get_feed_dict(batch)
-        qf = self._sess.run(tf.stop_gradient(self._pg_loss), feeds)
+        qf = self._sess.run(self._q_mean, feeds)
 
         return qf
     
@@ -50,7 +50,7 @@ def adaptive_isotropic_gaussian_kernel(xs, ys, h_min=1e-3):
 
     medians_sq = values[..., -1]  # ... (shape) (last element is the median)
 
-    h = medians_sq / np.log(Kx)  # ... (shape)
+    h = medians_sq / float(np.log(Kx))  # ... (shape)
     h = tf.maximum(h, h_min)
     h = tf.stop_gradient(h)  # Just in case.
     h_expanded_twice = tf.expand_dims(tf.expand_dims(h, -1), -1)
@@ -66,4 +66,170 @@ def adaptive_isotropic_gaussian_kernel(xs, ys, h_min=1e-3):
     kappa_grad = -2 * diff / h_expanded_thrice * kappa_expanded
     # ... x Kx x Ky x D
 
-    return {"output": kappa, "gradient": kappa_grad}
\ No newline at end of file
+    return {"output": kappa, "gradient": kappa_grad}
+
+
+def squared_distances(xs, ys):
+    """Pairwise squared distances |x|^2 + |y|^2 - 2 x.y of (... x Kx x D) and
+    (... x Ky x D) particles, as one batched matmul. Returns (... x Kx x Ky).
+    No (... x Kx x Ky x D) difference tensor is formed. Clipped at zero
+    against round-off."""
+    xx = tf.reduce_sum(xs**2, axis=-1)[..., :, None]
+    yy = tf.reduce_sum(ys**2, axis=-1)[..., None, :]
+    xy = tf.matmul(xs, ys, transpose_b=True)
+    return tf.maximum(xx + yy - 2 * xy, 0.)
+
+
+def _median(values, n):
+    # median of the last axis (of static size n), as in the exact kernel
+    top, _ = tf.nn.top_k(input=values, k=(n // 2 + 1), sorted=True)
+    return top[..., -1]
+
+
+def median_bandwidth(xs, ys, dist_sq=None, median_samples=None, h_min=1e-3):
+    """Bandwidth h = median(|x - y|^2) / log(Kx) of the adaptive kernels.
+
+    Args:
+        xs, ys(`tf.Tensor`): (... x Kx x D) and (... x Ky x D) particles.
+        dist_sq(`tf.Tensor`): Their (... x Kx x Ky) squared distances, if
+            already computed.
+        median_samples(`int`): If given, the median is estimated from that
+            many random (x, y) pairs (the same pairs for every leading
+            index) instead of all Kx * Ky of them. Only those pairs are
+            differenced, so this also holds without `dist_sq`.
+        h_min(`float`): Minimum bandwidth.
+    Returns:
+        `tf.Tensor` of the leading shape, without gradient.
+    """
+    Kx = xs.get_shape().as_list()[-2]
+    Ky = ys.get_shape().as_list()[-2]
+    if median_samples is None or median_samples >= Kx * Ky:
+        if dist_sq is None:
+            dist_sq = squared_distances(xs, ys)
+        flat_shape = tf.concat((tf.shape(xs)[:-2], [Kx * Ky]), axis=0)
+        medians_sq = _median(tf.reshape(dist_sq, flat_shape), Kx * Ky)
+    else:
+        x_idx = tf.random.uniform([median_samples], maxval=Kx, dtype=tf.int32)
+        y_idx = tf.random.uniform([median_samples], maxval=Ky, dtype=tf.int32)
+        pair_diff = tf.gather(xs, x_idx, axis=-2) - tf.gather(ys, y_idx, axis=-2)
+        medians_sq = _median(tf.reduce_sum(pair_diff**2, axis=-1), median_samples)
+
+    # a Python float keeps the particles' dtype under the NumPy type
+    # promotion that `maci.misc.sampler` turns on
+    h = medians_sq / float(np.log(Kx))
+    h = tf.maximum(h, h_min)
+    return tf.stop_gradient(h)
+
+
+def fast_isotropic_gaussian_kernel(xs, ys, h_min=1e-3, median_samples=None):
+    """`adaptive_isotropic_gaussian_kernel` from matmul-expanded distances.
+
+    Same arguments and dict fields, plus:
+        'mean_gradient': A `tf.Tensor` of shape (N x Ky x D), the mean of
+            'gradient' over the Kx axis, computed as
+            -2 / h * (kappa^T xs - (sum_x kappa) ys) / Kx.
+    'gradient' is still returned for compatibility, but the graph only
+    builds its (N x Kx x Ky x D) tensor if it is actually evaluated; SVGD
+    updates go through `stein_variational_gradient`, which only needs
+    'mean_gradient'. Memory is then O(N * Kx * Ky + N * (Kx + Ky) * D).
+    With `median_samples`, the bandwidth comes from that many random pairs
+    (see `median_bandwidth`).
+    """
+    Kx, D = xs.get_shape().as_list()[-2:]
+    Ky, D2 = ys.get_shape().as_list()[-2:]
+    assert D == D2
+
+    dist_sq = squared_distances(xs, ys)  # ... x Kx x Ky
+    h = median_bandwidth(xs, ys, dist_sq=dist_sq, median_samples=median_samples, h_min=h_min)
+    h_expanded_twice = h[..., None, None]  # ... x 1 x 1
+
+    kappa = tf.exp(-dist_sq / h_expanded_twice)  # ... x Kx x Ky
+
+    # sum_x grad_x k(x, y) = -2 / h * sum_x k(x, y) (x - y)
+    weighted_xs = tf.matmul(kappa, xs, transpose_a=True)  # ... x Ky x D
+    kappa_sum = tf.reduce_sum(kappa, axis=-2)[..., None]  # ... x Ky x 1
+    mean_gradient = -2 * (weighted_xs - kappa_sum * ys) / h_expanded_twice / Kx
+
+    diff = tf.expand_dims(xs, -2) - tf.expand_dims(ys, -3)
+    kappa_grad = -2 * diff / h_expanded_twice[..., None] * kappa[..., None]
+    # ... x Kx x Ky x D
+
+    return {"output": kappa, "gradient": kappa_grad, "mean_gradient": mean_gradient}
+
+
+def rff_isotropic_gaussian_kernel(xs, ys, h_min=1e-3, n_features=256, median_samples=256):
+    """Random-Fourier-feature approximation of the adaptive Gaussian kernel.
+
+    k(x, y) = exp(-|x - y|^2 / h) ~= phi(x) . phi(y), with
+    phi(x) = sqrt(2 / M) cos(w x + b), w ~ N(0, 2 / h I), b ~ U[0, 2 pi),
+    M = `n_features` (Rahimi & Recht, 2007). The features are redrawn on
+    every evaluation, and the bandwidth comes from `median_samples` random
+    pairs, so the SVGD update (`stein_variational_gradient`) costs
+    O(N * (Kx + Ky) * M * D) instead of O(N * Kx * Ky * D).
+
+    Returns the dict of `fast_isotropic_gaussian_kernel` ('output' and
+    'gradient' are only built if evaluated), plus:
+        'features': The (phi(xs), phi(ys)) pair, (N x Kx x M) and
+            (N x Ky x M).
+    """
+    Kx, D = xs.get_shape().as_list()[-2:]
+    Ky, D2 = ys.get_shape().as_list()[-2:]
+    assert D == D2
+
+    h = median_bandwidth(xs, ys, median_samples=median_samples, h_min=h_min)
+    scale = tf.sqrt(2. / h)[..., None, None]  # ... x 1 x 1
+
+    omega = tf.random.normal([D, n_features], dtype=xs.dtype)  # w = omega * sqrt(2 / h)
+    b = tf.random.uniform([n_features], maxval=2 * np.pi, dtype=xs.dtype)
+    norm = float(np.sqrt(2. / n_features))
+
+    proj_xs = tf.tensordot(xs, omega, axes=1) * scale + b
+    proj_ys = tf.tensordot(ys, omega, axes=1) * scale + b
+    phi_xs = norm * tf.cos(proj_xs)  # ... x Kx x M
+    phi_ys = norm * tf.cos(proj_ys)  # ... x Ky x M
+    dphi_xs = -norm * tf.sin(proj_xs)  # d phi / d(w x), ... x Kx x M
+
+    kappa = tf.matmul(phi_xs, phi_ys, transpose_b=True)  # ... x Kx x Ky
+
+    # sum_x grad_x k(x, y) = sum_m phi_m(y) (sum_x dphi_m(x)) w_m
+    dphi_sum = tf.reduce_sum(dphi_xs, axis=-2)[..., None, :]  # ... x 1 x M
+    mean_gradient = tf.tensordot(phi_ys * dphi_sum, tf.transpose(omega), axes=1) * scale / Kx
+    # ... x Ky x D
+
+    kappa_grad = tf.einsum('...xm,...ym,dm->...xyd', dphi_xs, phi_ys, omega) * scale[..., None]
+    # ... x Kx x Ky x D
+
+    return {"output": kappa, "gradient": kappa_grad, "mean_gradient": mean_gradient,
+            "features": (phi_xs, phi_ys)}
+
+
+KERNEL_FNS = {
+    'exact': adaptive_isotropic_gaussian_kernel,
+    'fast': fast_isotropic_gaussian_kernel,
+    'rff': rff_isotropic_gaussian_kernel,
+}
+
+
+def stein_variational_gradient(kernel_dict, grad_log_p):
+    """SVGD direction mean_x [k(x, y) grad_x log p(x) + grad_x k(x, y)].
+
+    Args:
+        kernel_dict(`dict`): Output of a kernel function for (xs, ys).
+        grad_log_p(`tf.Tensor`): (N x Kx x D) score at the fixed particles xs.
+    Returns:
+        `tf.Tensor` of shape (N x Ky x D), one direction per updated particle.
+        Only the reduced kernel terms are used when the kernel provides them
+        ('mean_gradient', 'features'); otherwise the full 'gradient' is
+        averaged as before.
+    """
+    Kx = tf.cast(tf.shape(grad_log_p)[-2], grad_log_p.dtype)
+    if 'features' in kernel_dict:
+        phi_xs, phi_ys = kernel_dict['features']
+        driving = tf.matmul(phi_ys, tf.matmul(phi_xs, grad_log_p, transpose_a=True)) / Kx
+    else:
+        driving = tf.matmul(kernel_dict['output'], grad_log_p, transpose_a=True) / Kx
+    if 'mean_gradient' in kernel_dict:
+        repulsive = kernel_dict['mean_gradient']
+    else:
+        repulsive = tf.reduce_mean(kernel_dict['gradient'], axis=-3)
+    return driving + repulsive
@@ -0,0 +1,121 @@
+import numpy as np
+
+
+class ActionNoise(object):
+    """Action-space exploration noise with one process per environment.
+
+    The state is an (n_envs, action_dim) matrix. `sample_envs()` advances
+    every environment's process by one step and returns the
+    (n_envs, action_dim) noise, row e for environment e; it is what a
+    sampler acting in its environments draws. `sample_stationary(n)` gets
+    n independent draws from the stationary distribution and leaves the
+    environments' states untouched (e.g. for a training batch passed
+    through a policy). `reset(env_ids)` restarts the processes of the
+    given environments (all by default), e.g. at their episode ends.
+    """
+
+    def __init__(self, action_dim, n_envs=1, mu=0.):
+        self.action_dim = action_dim
+        self.mu = mu
+        self.n_envs = n_envs
+        self.state = np.full((n_envs, action_dim), mu, dtype=np.float64)
+
+    def set_n_envs(self, n_envs):
+        if n_envs != self.n_envs:
+            self.n_envs = n_envs
+            self.state = np.full((n_envs, self.action_dim), self.mu, dtype=np.float64)
+
+    def reset(self, env_ids=None):
+        if env_ids is None:
+            self.state[:] = self.mu
+        else:
+            self.state[env_ids] = self.mu
+
+    def sample_envs(self):
+        return self._step().copy()
+
+    def sample_stationary(self, n):
+        return self._stationary(n)
+
+    def _step(self):
+        raise NotImplementedError
+
+    def _stationary(self, n):
+        raise NotImplementedError
+
+
+class GaussianActionNoise(ActionNoise):
+    """Independent N(mu, sigma^2) noise at every step."""
+
+    def __init__(self, action_dim, n_envs=1, mu=0., sigma=0.3):
+        super(GaussianActionNoise, self).__init__(action_dim, n_envs=n_envs, mu=mu)
+        self.sigma = sigma
+
+    def _step(self):
+        self.state[:] = self._stationary(self.n_envs)
+        return self.state
+
+    def _stationary(self, n):
+        return self.mu + self.sigma * np.random.randn(n, self.action_dim)
+
+
+class OUActionNoise(ActionNoise):
+    """Ornstein-Uhlenbeck noise, x <- x + theta * (mu - x) + sigma * N(0, 1).
+
+    The stationary distribution is N(mu, sigma^2 / (theta * (2 - theta))).
+    """
+
+    def __init__(self, action_dim, n_envs=1, mu=0., theta=0.15, sigma=0.3):
+        super(OUActionNoise, self).__init__(action_dim, n_envs=n_envs, mu=mu)
+        self.theta = theta
+        self.sigma = sigma
+
+    def _step(self):
+        self.state += self.theta * (self.mu - self.state) + self.sigma * np.random.randn(*self.state.shape)
+        return self.state
+
+    def _stationary(self, n):
+        scale = self.sigma / np.sqrt(self.theta * (2. - self.theta))
+        return self.mu + scale * np.random.randn(n, self.action_dim)
+
+
+class ParameterNoise(object):
+    """Parameter-space exploration noise (Plappert et al., 2018).
+
+    Holds one Gaussian perturbation of a set of parameter arrays per
+    environment, `deltas[j]` of shape (n_envs,) + shapes[j]. The
+    perturbations are redrawn by `reset(env_ids)`, at episode ends, so an
+    environment explores with one consistent perturbed policy per episode.
+    `adapt` keeps the induced action change near `target_distance`: sigma
+    shrinks by `adaptation` when the perturbed actions moved further than
+    that from the unperturbed ones, and grows otherwise.
+    """
+
+    def __init__(self, shapes, n_envs=1, sigma=0.1, target_distance=0.2, adaptation=1.01):
+        self.shapes = [tuple(shape) for shape in shapes]
+        self.sigma = sigma
+        self.target_distance = target_distance
+        self.adaptation = adaptation
+        self.n_envs = n_envs
+        self.deltas = [np.zeros((n_envs,) + shape, dtype=np.float32) for shape in self.shapes]
+        self.reset()
+
+    def set_n_envs(self, n_envs):
+        if n_envs != self.n_envs:
+            self.n_envs = n_envs
+            self.deltas = [np.zeros((n_envs,) + shape, dtype=np.float32) for shape in self.shapes]
+            self.reset()
+
+    def reset(self, env_ids=None):
+        for delta in self.deltas:
+            if env_ids is None:
+                delta[:] = self.sigma * np.random.randn(*delta.shape)
+            else:
+                delta[env_ids] = self.sigma * np.random.randn(*delta[env_ids].shape)
+
+    def adapt(self, distance):
+        """Rescale sigma from the distance between perturbed and unperturbed actions."""
+        if distance > self.target_distance:
+            self.sigma /= self.adaptation
+        else:
+            self.sigma *= self.adaptation
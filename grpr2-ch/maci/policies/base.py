@@ -14,6 +14,11 @@ class Policy(Parameterized):
     def get_actions(self, observations):
         raise NotImplementedError
 
+    def get_env_actions(self, observations):
+        """Actions of a sampler acting in one environment per row. Policies
+        with per-environment exploration state advance it here only."""
+        return self.get_actions(observations)
+
     def reset(self, dones=None):
         pass
 
@@ -0,0 +1,314 @@
+import numpy as np
+import tensorflow as tf
+
+from .deterministic_policy import DeterministicNNPolicy, ConditionalDeterministicNNPolicy
+from .level_k_policy import MultiLevelPolicy, GeneralizedMultiLevelPolicy
+from .stochastic_policy import StochasticNNPolicy, StochasticNNConditionalPolicy
+from .uniform_policy import UniformPolicy
+
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def _sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+
+# NumPy versions of the squash functions the policies are built with
+SQUASH_FUNCS = {
+    tf.tanh: np.tanh,
+    tf.nn.tanh: np.tanh,
+    tf.nn.softmax: _softmax,
+    tf.nn.sigmoid: _sigmoid,
+}
+
+
+class NumpyMLP(object):
+    """`feedforward_net` evaluated in NumPy.
+
+    Mirrors the network under the variable scope `scope`. Its weights live
+    in preallocated arrays (`params`, in the order of `variables`), which
+    `NumpyActorEngine.sync` overwrites in place. The first-layer weights of
+    the different inputs are row blocks of one matrix, so the first layer
+    is a single matmul of the concatenated inputs.
+    """
+
+    def __init__(self, scope, n_inputs, layer_sizes, variables):
+        """
+        Args:
+            scope (`str`): Full variable scope of the network.
+            n_inputs (`int`): Number of input tensors of the first layer.
+            layer_sizes (`list`): Layer sizes, including the output layer.
+            variables (`dict`): Variable name (without ':0') to variable.
+        """
+        self.scope = scope
+        self.variables = []
+        self.params = []
+        self._layers = [] # (weight, bias) per layer
+        for i in range(len(layer_sizes)):
+            layer = '{}/layer_{}/'.format(scope, i)
+            names = ['weight_{}'.format(j) if j else 'weight' for j in range(n_inputs if i == 0 else 1)]
+            for name in names + ['bias']:
+                if layer + name not in variables:
+                    raise ValueError('No variable {} to mirror'.format(layer + name))
+                self.variables.append(variables[layer + name])
+            weights = [variable.shape.as_list() for variable in self.variables[-len(names) - 1:-1]]
+            weight = np.zeros((sum(shape[0] for shape in weights), layer_sizes[i]), dtype=np.float32)
+            bias = np.zeros(layer_sizes[i], dtype=np.float32)
+            rows = np.cumsum([0] + [shape[0] for shape in weights])
+            self.params += [weight[start:stop] for start, stop in zip(rows[:-1], rows[1:])] + [bias]
+            self._layers.append((weight, bias))
+
+    @property
+    def param_shapes(self):
+        """Shapes of the (stacked) weight and the bias of every layer."""
+        return [param.shape for layer in self._layers for param in layer]
+
+    def __call__(self, *inputs, deltas=None):
+        """
+        Args:
+            deltas (`list`): Optional perturbations of the `param_shapes`
+                arrays, each with a leading axis of one row per input row,
+                or of a single row shared by all inputs (`ParameterNoise`).
+        """
+        out = np.concatenate(inputs, axis=-1) if len(inputs) > 1 else inputs[0]
+        for i, (weight, bias) in enumerate(self._layers):
+            if i > 0:
+                np.maximum(out, 0., out=out)
+            if deltas is None:
+                out = np.dot(out, weight)
+                out += bias
+            elif deltas[2 * i].shape[0] == 1:
+                out = np.dot(out, weight + deltas[2 * i][0]) + (bias + deltas[2 * i + 1][0])
+            else:
+                out = np.dot(out, weight) + np.einsum('ei,eio->eo', out, deltas[2 * i]) + (bias + deltas[2 * i + 1])
+        return out
+
+
+class NumpyActor(object):
+    """Acts like the mirrored policy, without the TF session."""
+
+    def __init__(self, policy):
+        self.policy = policy
+
+    def actions_for(self, observations, *args, envs=False):
+        """
+        Args:
+            envs (`bool`): The rows are the sampler's environments, which
+                act with their own exploration state.
+        """
+        raise NotImplementedError
+
+    def get_action(self, observation):
+        return self.get_env_actions(observation[None])[0], None
+
+    def get_actions(self, observations):
+        return self.actions_for(np.asarray(observations, dtype=np.float32))
+
+    def get_env_actions(self, observations):
+        return self.actions_for(np.asarray(observations, dtype=np.float32), envs=True)
+
+    def reset_noise(self, env_ids=None):
+        reset_noise = getattr(self.policy, 'reset_noise', None)
+        if reset_noise is not None:
+            reset_noise(env_ids)
+
+
+class UniformActor(NumpyActor):
+    def actions_for(self, observations, envs=False):
+        policy = self.policy
+        actions = np.random.uniform(policy._urange[0], policy._urange[1],
+                                    (observations.shape[0], policy._action_dim)).astype(np.float32)
+        return _softmax(actions) if policy._if_softmax else actions
+
+
+class MLPActor(NumpyActor):
+    """`actions_for` of the (conditional) deterministic and stochastic policies."""
+
+    def __init__(self, policy, mlp, n_latents=0):
+        super(MLPActor, self).__init__(policy)
+        self.mlp = mlp
+        self.parameter_noise = None
+        self._n_latents = n_latents
+
+    def set_parameter_noise(self, noise):
+        """Act with the per-environment weight perturbations of a
+        `ParameterNoise` over `mlp.param_shapes` (None to stop)."""
+        self.parameter_noise = noise
+
+    def adapt_parameter_noise(self, observations):
+        """Adapt the parameter noise scale to the RMS change of the network
+        output it causes on `observations` (with the first environment's
+        perturbation)."""
+        observations = np.asarray(observations, dtype=np.float32)
+        deltas = [delta[:1] for delta in self.parameter_noise.deltas]
+        inputs = (observations,)
+        if self._n_latents:
+            inputs += (np.zeros((observations.shape[0], self._n_latents), dtype=np.float32),)
+        distance = np.sqrt(np.mean((self.mlp(*inputs, deltas=deltas) - self.mlp(*inputs)) ** 2))
+        self.parameter_noise.adapt(distance)
+
+    def reset_noise(self, env_ids=None):
+        super(MLPActor, self).reset_noise(env_ids)
+        if self.parameter_noise is not None:
+            self.parameter_noise.reset(env_ids)
+
+    def actions_for(self, observations, *actions, envs=False):
+        inputs = (observations,) + actions
+        if self._n_latents:
+            inputs += (np.random.standard_normal((observations.shape[0], self._n_latents)).astype(np.float32),)
+        deltas = None
+        if envs and self.parameter_noise is not None:
+            deltas = self.parameter_noise.deltas
+        raw_actions = self.mlp(*inputs, deltas=deltas)
+
+        policy = self.policy
+        if policy.sampling:
+            u = np.random.uniform(size=raw_actions.shape)
+            return _softmax(raw_actions - np.log(-np.log(u))).astype(np.float32)
+        if policy._squash:
+            return policy._u_range * SQUASH_FUNCS[policy._squash_func](raw_actions)
+        return np.clip(raw_actions, -policy._u_range, policy._u_range)
+
+
+class DeterministicActor(MLPActor):
+    # exploration noise as in `DeterministicNNPolicy` and
+    # `ConditionalDeterministicNNPolicy` (which also take the conditioning
+    # actions), from the policy's own noise process; parameter noise replaces it
+
+    def get_action(self, observation, *self_actions):
+        self_actions = [action[None] for action in self_actions]
+        return self.get_env_actions(observation[None], *self_actions)[0], None
+
+    def get_actions(self, observations, *self_actions):
+        actions = self.actions_for(np.asarray(observations, dtype=np.float32), *self_actions)
+        if self.parameter_noise is not None:
+            return actions
+        return self.policy._explore(actions, self.policy.noise.sample_stationary(len(actions)))
+
+    def get_env_actions(self, observations, *self_actions):
+        actions = self.actions_for(np.asarray(observations, dtype=np.float32), *self_actions, envs=True)
+        if self.parameter_noise is not None:
+            return actions
+        return self.policy._explore(actions, self.policy.noise.sample_envs())
+
+
+class LevelKActor(NumpyActor):
+    """`MultiLevelPolicy`: the level chain from the base policy up to level k."""
+
+    def __init__(self, policy, base, own, opponent):
+        super(LevelKActor, self).__init__(policy)
+        self._base = base
+        self._own = own
+        self._opponent = opponent
+
+    def chain(self, observations, envs=False):
+        k = self.policy._k
+        action = self._base.actions_for(observations, envs=envs)
+        all_actions = [action]
+        for i in range(1, k + 1):
+            actor = self._own if (k - i) % 2 == 0 else self._opponent
+            action = actor.actions_for(observations, action, envs=envs)
+            all_actions.append(action)
+        return all_actions
+
+    def actions_for(self, observations, envs=False):
+        return self.chain(observations, envs=envs)[-1]
+
+
+class GeneralizedLevelKActor(NumpyActor):
+    """`GeneralizedMultiLevelPolicy`: the mixture over the shared level chains."""
+
+    def __init__(self, policy, levels):
+        super(GeneralizedLevelKActor, self).__init__(policy)
+        self._levels = levels
+        self._tops = {}
+        for level in levels:
+            parity = level.policy._k % 2
+            if parity not in self._tops or level.policy._k > self._tops[parity].policy._k:
+                self._tops[parity] = level
+
+    def actions_for(self, observations, envs=False):
+        policy = self.policy
+        chains = {parity: level.chain(observations, envs=envs) for parity, level in self._tops.items()}
+        action = 0.
+        for dist, level in zip(policy._dists, self._levels):
+            action = action + dist * (policy._correction_factor + chains[level.policy._k % 2][level.policy._k])
+        return (action - policy._correction_factor).astype(np.float32)
+
+
+class NumpyActorEngine(object):
+    """Actor-side inference of TF policies in NumPy.
+
+    For every policy, `actors` holds a `NumpyActor` with the same
+    `get_action`/`get_actions` as the policy (the samplers take it through
+    `set_actors`). A 1-row action is then a few small matmuls instead of a
+    session run, and sampling no longer contends with the learner for the
+    session. The weights are copied from the policies' variables, all in
+    one session run, by `sync`, which `step` calls every `sync_interval`
+    learner steps. Networks that several policies share (e.g. the levels of
+    a generalized level-k policy) are mirrored and synced once.
+
+    Supported: `DeterministicNNPolicy`, `StochasticNNPolicy`, their
+    conditional versions, `UniformPolicy`, `MultiLevelPolicy` and
+    `GeneralizedMultiLevelPolicy`, built at the root variable scope.
+    """
+
+    def __init__(self, policies, sync_interval=1):
+        self.sync_interval = sync_interval
+        self.n_steps = 0
+        self._variables = {v.op.name: v for v in tf.compat.v1.global_variables()}
+        self._mlps = {}
+        self.actors = [self._actor(policy, '') for policy in policies]
+        del self._variables
+        self.sync()
+
+    def _mlp(self, policy, scope, n_inputs):
+        scope = scope + policy._name
+        if scope not in self._mlps:
+            self._mlps[scope] = NumpyMLP(scope, n_inputs, policy._layer_sizes, self._variables)
+        return self._mlps[scope]
+
+    def _actor(self, policy, scope):
+        # `scope` is the variable scope prefix `policy.actions_for` runs under
+        if isinstance(policy, GeneralizedMultiLevelPolicy):
+            return GeneralizedLevelKActor(policy, [self._actor(level, scope + policy._name + '/')
+                                                   for level in policy._policies])
+        if isinstance(policy, MultiLevelPolicy):
+            return LevelKActor(policy,
+                               self._actor(policy._base_policy, scope),
+                               self._actor(policy._conditional_policy, scope + policy._name + '/'),
+                               self._actor(policy._opponent_conditional_policy, scope))
+        if isinstance(policy, UniformPolicy):
+            return UniformActor(policy)
+        if isinstance(policy, DeterministicNNPolicy):
+            return DeterministicActor(policy, self._mlp(policy, scope, 1))
+        if isinstance(policy, ConditionalDeterministicNNPolicy):
+            return DeterministicActor(policy, self._mlp(policy, scope, 2))
+        if isinstance(policy, StochasticNNPolicy):
+            return MLPActor(policy, self._mlp(policy, scope, 2), n_latents=policy._action_dim)
+        if isinstance(policy, StochasticNNConditionalPolicy):
+            return MLPActor(policy, self._mlp(policy, scope, 3), n_latents=policy._opponent_action_dim)
+        raise TypeError('No NumPy actor for {}'.format(type(policy).__name__))
+
+    def sync(self):
+        """Copy the current TF weights into the actors' arrays."""
+        mlps = list(self._mlps.values())
+        values = tf.compat.v1.get_default_session().run([mlp.variables for mlp in mlps])
+        for mlp, mlp_values in zip(mlps, values):
+            for param, value in zip(mlp.params, mlp_values):
+                np.copyto(param, value)
+
+    def step(self):
+        """Count one learner step and resync every `sync_interval` steps.
+
+        Returns:
+            True if the weights were synced.
+        """
+        self.n_steps += 1
+        if self.n_steps % self.sync_interval == 0:
+            self.sync()
+            return True
+        return False
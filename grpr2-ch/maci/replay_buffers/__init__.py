@@ -1,2 +1,4 @@
 from .simple_replay_buffer import SimpleReplayBuffer
 from .indexed_replay_buffer import IndexedReplayBuffer
+from .multi_agent_replay_buffer import MultiAgentReplayBuffer, AgentReplayView
+from .storage import AdjacencyStorage, MemmapStore
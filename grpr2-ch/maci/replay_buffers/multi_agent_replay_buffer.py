@@ -0,0 +1,212 @@
+import numpy as np
+
+from maci.core.serializable import Serializable
+
+from maci.replay_buffers.replay_buffer import ReplayBuffer
+from maci.replay_buffers.storage import AdjacencyStorage, MemmapStore, storage_dtype, upcast
+
+
+class MultiAgentReplayBuffer(ReplayBuffer, Serializable):
+    """Joint replay store for all agents with a single ring index.
+
+    Per-agent fields (observations, actions, rewards, ...) live side by side in
+    one array per field, so every agent is a column view of the same rows.
+    Joint fields (adjacency matrix, graph log-prob and, if `full_obs_dim`
+    is given, the raw joint observation) are stored once instead of once
+    per agent. A batch for the whole team is produced by a single
+    fancy-index gather per field.
+
+    `dtype` and `pack_adj_mat` select the storage precision, `directory`
+    the memory-mapped backend and `n_edges` the sparse graph layout, as in
+    `SimpleReplayBuffer`; sampled batches are always float32.
+    """
+
+    def __init__(self, env_spec, agent_num, max_replay_buffer_size, full_obs_dim=None, joint=False,
+                 dtype='float32', pack_adj_mat=False, directory=None, n_edges=None):
+        super(MultiAgentReplayBuffer, self).__init__()
+        Serializable.quick_init(self, locals())
+
+        max_replay_buffer_size = int(max_replay_buffer_size)
+        self._dtype = storage_dtype(dtype)
+        self._store = None if directory is None else MemmapStore(directory)
+        self.joint = joint
+        self.agent_num = agent_num
+        self._env_spec = env_spec
+
+        self._observation_dims = [env_spec.observation_space[i].flat_dim for i in range(agent_num)]
+        self._action_dims = [env_spec.action_space[i].flat_dim for i in range(agent_num)]
+        self._observation_offsets = np.concatenate([[0], np.cumsum(self._observation_dims)])
+        self._action_offsets = np.concatenate([[0], np.cumsum(self._action_dims)])
+        self._full_obs_dim = full_obs_dim
+
+        self._max_buffer_size = max_replay_buffer_size
+        self._observations = self._zeros('observations', (max_replay_buffer_size, self._observation_offsets[-1]), self._dtype)
+        self._next_obs = self._zeros('next_obs', (max_replay_buffer_size, self._observation_offsets[-1]), self._dtype)
+        self._actions = self._zeros('actions', (max_replay_buffer_size, self._action_offsets[-1]), self._dtype)
+        self._rewards = self._zeros('rewards', (max_replay_buffer_size, agent_num), np.float32)
+        self._terminals = self._zeros('terminals', (max_replay_buffer_size, agent_num), np.uint8)
+        # joint fields, shared by all agents
+        self._adj_mat = AdjacencyStorage(max_replay_buffer_size, agent_num, packed=pack_adj_mat, alloc=self._zeros,
+                                         n_edges=n_edges)
+        self._log_adj_mat = self._zeros('log_adj_mat', (max_replay_buffer_size, 1), np.float32)
+        self._full_obs = None
+        if full_obs_dim is not None:
+            self._full_obs = self._zeros('full_obs', (max_replay_buffer_size, full_obs_dim), self._dtype)
+        self._top = 0
+        self._size = 0
+        self.indices = None
+        if self._store is not None and self._store.resumed:
+            self._top, self._size = self._store.top, self._store.size
+
+    def _zeros(self, name, shape, dtype):
+        if self._store is None:
+            return np.zeros(shape, dtype=dtype)
+        return self._store.zeros(name, shape, dtype)
+
+    def add_sample(self, observation_n, action_n, reward_n, terminal_n,
+                   next_observation_n, adj_mat, log_adj_mat, full_obs=None, **kwargs):
+        self.add_samples(observations_n=[np.reshape(o, (1, -1)) for o in observation_n],
+                         actions_n=[np.reshape(a, (1, -1)) for a in action_n],
+                         rewards=np.reshape(reward_n, (1, -1)),
+                         terminals=np.reshape(terminal_n, (1, -1)),
+                         next_observations_n=[np.reshape(o, (1, -1)) for o in next_observation_n],
+                         adj_mats=np.reshape(adj_mat, (1,) + self._adj_mat.shape),
+                         log_adj_mats=np.reshape(log_adj_mat, (1, 1)),
+                         full_obs=None if full_obs is None else np.reshape(full_obs, (1, -1)))
+
+    def add_samples(self, observations_n, actions_n, rewards, terminals,
+                    next_observations_n, adj_mats, log_adj_mats, full_obs=None, **kwargs):
+        # observations_n, actions_n and next_observations_n hold one
+        # (n_samples, dim) array per agent; the other fields are joint.
+        n_samples = len(rewards)
+        indices = (self._top + np.arange(n_samples)) % self._max_buffer_size
+        self._observations[indices] = np.concatenate(observations_n, axis=-1)
+        self._next_obs[indices] = np.concatenate(next_observations_n, axis=-1)
+        self._actions[indices] = np.concatenate(actions_n, axis=-1)
+        self._rewards[indices] = rewards
+        self._terminals[indices] = terminals
+        self._adj_mat[indices] = adj_mats
+        self._log_adj_mat[indices] = np.reshape(log_adj_mats, (n_samples, 1))
+        if self._full_obs is not None:
+            self._full_obs[indices] = full_obs
+        self._advance(n_samples)
+
+    def terminate_episode(self):
+        pass
+
+    def _advance(self, n_samples=1):
+        self._top = (self._top + n_samples) % self._max_buffer_size
+        self._size = min(self._size + n_samples, self._max_buffer_size)
+        if self._store is not None:
+            self._store.advance(n_samples, self._top, self._size)
+
+    def flush(self):
+        if self._store is not None:
+            self._store.flush(self._top, self._size)
+
+    def random_indices(self, batch_size):
+        self.indices = np.random.randint(0, self._size, batch_size)
+        return self.indices
+
+    def random_batch(self, batch_size):
+        return self.random_batch_n(batch_size)
+
+    def random_batch_n(self, batch_size):
+        return self.batch_n_by_indices(self.random_indices(batch_size))
+
+    def batch_n_by_indices(self, indices):
+        """Gather the rows `indices` once and split them into per-agent batches.
+
+        The per-agent observation/action arrays are column views of the joint
+        gather, and the joint fields are the same arrays in every batch.
+        """
+        observations = upcast(self._observations[indices])
+        next_observations = upcast(self._next_obs[indices])
+        actions = upcast(self._actions[indices])
+        rewards = self._rewards[indices]
+        terminals = self._terminals[indices]
+        adj_mats = self._adj_mat[indices]
+        log_adj_mats = self._log_adj_mat[indices]
+        full_obs = None if self._full_obs is None else upcast(self._full_obs[indices])
+
+        batch_n = []
+        for i in range(self.agent_num):
+            o_start, o_end = self._observation_offsets[i], self._observation_offsets[i + 1]
+            a_start, a_end = self._action_offsets[i], self._action_offsets[i + 1]
+            batch = dict(
+                observations=observations[:, o_start:o_end],
+                actions=actions[:, a_start:a_end],
+                rewards=rewards[:, i],
+                terminals=terminals[:, i],
+                next_observations=next_observations[:, o_start:o_end],
+                adj_mats=adj_mats,
+                log_adj_mats=log_adj_mats,
+            )
+            if full_obs is not None:
+                batch['full_obs'] = full_obs
+            if self.joint:
+                batch['opponent_actions'] = np.concatenate([actions[:, :a_start], actions[:, a_end:]], axis=-1)
+            batch_n.append(batch)
+        return batch_n
+
+    def agent_batch_by_indices(self, agent_id, indices):
+        o_start, o_end = self._observation_offsets[agent_id], self._observation_offsets[agent_id + 1]
+        a_start, a_end = self._action_offsets[agent_id], self._action_offsets[agent_id + 1]
+        batch = dict(
+            observations=upcast(self._observations[indices, o_start:o_end]),
+            actions=upcast(self._actions[indices, a_start:a_end]),
+            rewards=self._rewards[indices, agent_id],
+            terminals=self._terminals[indices, agent_id],
+            next_observations=upcast(self._next_obs[indices, o_start:o_end]),
+            adj_mats=self._adj_mat[indices],
+            log_adj_mats=self._log_adj_mat[indices],
+        )
+        if self._full_obs is not None:
+            batch['full_obs'] = upcast(self._full_obs[indices])
+        if self.joint:
+            actions = upcast(self._actions[indices])
+            batch['opponent_actions'] = np.concatenate([actions[:, :a_start], actions[:, a_end:]], axis=-1)
+        return batch
+
+    def agent_view(self, agent_id):
+        return AgentReplayView(self, agent_id)
+
+    @property
+    def size(self):
+        return self._size
+
+
+class AgentReplayView(object):
+    """Single-agent view of a `MultiAgentReplayBuffer`.
+
+    Exposes the `SimpleReplayBuffer` sampling interface for one agent, so it
+    can be passed as an agent's `pool`. Samples are written through the
+    shared buffer, not through the view.
+    """
+
+    def __init__(self, buffer, agent_id):
+        self._buffer = buffer
+        self.agent_id = agent_id
+        self.agent_num = buffer.agent_num
+        self.joint = buffer.joint
+        self.indices = None
+        self._observation_dim = buffer._observation_dims[agent_id]
+        self._action_dim = buffer._action_dims[agent_id]
+
+    def random_batch(self, batch_size):
+        self.indices = np.random.randint(0, self._buffer.size, batch_size)
+        return self.random_batch_by_indices(self.indices)
+
+    def random_batch_by_indices(self, indices):
+        return self._buffer.agent_batch_by_indices(self.agent_id, indices)
+
+    def terminate_episode(self):
+        pass
+
+    @property
+    def _top(self):
+        return self._buffer._top
+
+    @property
+    def size(self):
+        return self._buffer.size
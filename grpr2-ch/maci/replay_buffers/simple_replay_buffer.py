@@ -3,15 +3,35 @@ import numpy as np
 from maci.core.serializable import Serializable
 
 from maci.replay_buffers.replay_buffer import ReplayBuffer
+from maci.replay_buffers.storage import AdjacencyStorage, MemmapStore, storage_dtype, upcast
 from maci.environments.env_spec import MAEnvSpec
 
 
 class SimpleReplayBuffer(ReplayBuffer, Serializable):
-    def __init__(self, env_spec, agent_num, max_replay_buffer_size, joint=False, agent_id=None):
+    def __init__(self, env_spec, agent_num, max_replay_buffer_size, joint=False, agent_id=None,
+                 dtype='float32', pack_adj_mat=False, directory=None, n_edges=None, full_obs_dim=None):
+        """
+        Args:
+            dtype (`str`): Storage dtype of observations and actions
+                ('float64', 'float32' or 'float16'). Rewards are kept as
+                float32 and every sampled field is returned as float32.
+            pack_adj_mat (`bool`): Bit-pack the 0/1 adjacency matrices
+                (one bit per entry instead of a float32).
+            directory (`str`): If given, keep every array in a memory-mapped
+                file under this directory (see `MemmapStore`). A buffer
+                created again on an existing directory resumes from it.
+            n_edges (`int`): Store the edge bits of a sparse `GraphFlows`
+                graph (its `out_size`) instead of (n, n) adjacency matrices.
+            full_obs_dim (`int`): Also store the raw joint observation each
+                graph was sampled from (the senders of a k-neighbour sparse
+                graph depend on it); batches then carry 'full_obs'.
+        """
         super(SimpleReplayBuffer, self).__init__()
         Serializable.quick_init(self, locals())
 
         max_replay_buffer_size = int(max_replay_buffer_size)
+        self._dtype = storage_dtype(dtype)
+        self._store = None if directory is None else MemmapStore(directory)
         self.joint = joint
         self.agent_num = agent_num
         self._env_spec = env_spec
@@ -23,26 +43,37 @@ class SimpleReplayBuffer(ReplayBuffer, Serializable):
             if joint:
                 self._opponent_action_dim = env_spec.action_space.opponent_flat_dim(agent_id)
                 print(agent_id, self._opponent_action_dim )
-                self._opponent_actions = np.zeros((max_replay_buffer_size, self._opponent_action_dim ))
+                self._opponent_actions = self._zeros('opponent_actions', (max_replay_buffer_size, self._opponent_action_dim), self._dtype)
         else:
             self._action_dim = env_spec.action_space.flat_dim
             self._observation_dim = env_spec.observation_space.flat_dim
 
         self._max_buffer_size = max_replay_buffer_size
-        self._observations = np.zeros((max_replay_buffer_size,
-                                       self._observation_dim))
+        self._observations = self._zeros('observations', (max_replay_buffer_size,
+                                                          self._observation_dim), self._dtype)
         # It's a bit memory inefficient to save the observations twice,
         # but it makes the code *much* easier since you no longer have to
         # worry about termination conditions.
-        self._next_obs = np.zeros((max_replay_buffer_size,
-                                   self._observation_dim))
-        self._actions = np.zeros((max_replay_buffer_size, self._action_dim))
-        self._adj_mat = np.zeros((max_replay_buffer_size, self.agent_num, self.agent_num), dtype=np.float32)    
-        self._log_adj_mat = np.zeros((max_replay_buffer_size, 1), dtype=np.float32) 
-        self._rewards = np.zeros(max_replay_buffer_size)
-        self._terminals = np.zeros(max_replay_buffer_size, dtype='uint8')
+        self._next_obs = self._zeros('next_obs', (max_replay_buffer_size,
+                                                  self._observation_dim), self._dtype)
+        self._actions = self._zeros('actions', (max_replay_buffer_size, self._action_dim), self._dtype)
+        self._adj_mat = AdjacencyStorage(max_replay_buffer_size, self.agent_num, packed=pack_adj_mat,
+                                         alloc=self._zeros, n_edges=n_edges)
+        self._log_adj_mat = self._zeros('log_adj_mat', (max_replay_buffer_size, 1), np.float32)
+        self._rewards = self._zeros('rewards', (max_replay_buffer_size,), np.float32)
+        self._terminals = self._zeros('terminals', (max_replay_buffer_size,), np.uint8)
+        self._full_obs = None
+        if full_obs_dim is not None:
+            self._full_obs = self._zeros('full_obs', (max_replay_buffer_size, full_obs_dim), self._dtype)
         self._top = 0
         self._size = 0
+        if self._store is not None and self._store.resumed:
+            self._top, self._size = self._store.top, self._store.size
+
+    def _zeros(self, name, shape, dtype):
+        if self._store is None:
+            return np.zeros(shape, dtype=dtype)
+        return self._store.zeros(name, shape, dtype)
 
     def add_sample(self, observation, action, reward, terminal,
                    next_observation, adj_mat, log_adj_mat, **kwargs):
@@ -57,43 +88,74 @@ class SimpleReplayBuffer(ReplayBuffer, Serializable):
             # print('added')
             # todo: fix adding opponent action
             self._opponent_actions[self._top] = kwargs['opponent_action']
+        if self._full_obs is not None:
+            self._full_obs[self._top] = kwargs['full_obs']
         self._advance()
 
+    def add_samples(self, observations, actions, rewards, terminals,
+                    next_observations, adj_mats, log_adj_mats, **kwargs):
+        # writes a batch of transitions (one per environment copy) with a
+        # single slice assignment per field.
+        n_samples = len(rewards)
+        indices = (self._top + np.arange(n_samples)) % self._max_buffer_size
+        self._observations[indices] = observations
+        self._actions[indices] = actions
+        self._rewards[indices] = rewards
+        self._terminals[indices] = terminals
+        self._next_obs[indices] = next_observations
+        self._adj_mat[indices] = adj_mats
+        self._log_adj_mat[indices] = np.reshape(log_adj_mats, (n_samples, 1))
+        if 'opponent_actions' in kwargs:
+            self._opponent_actions[indices] = kwargs['opponent_actions']
+        if self._full_obs is not None:
+            self._full_obs[indices] = kwargs['full_obs']
+        self._advance(n_samples)
+
     def terminate_episode(self):
         pass
 
-    def _advance(self):
-        self._top = (self._top + 1) % self._max_buffer_size
-        if self._size < self._max_buffer_size:
-            self._size += 1
+    def _advance(self, n_samples=1):
+        self._top = (self._top + n_samples) % self._max_buffer_size
+        self._size = min(self._size + n_samples, self._max_buffer_size)
+        if self._store is not None:
+            self._store.advance(n_samples, self._top, self._size)
+
+    def flush(self):
+        """Write a memory-mapped buffer and its `_top`/`_size` to disk."""
+        if self._store is not None:
+            self._store.flush(self._top, self._size)
 
     def random_batch(self, batch_size):
         self.indices = np.random.randint(0, self._size, batch_size)
         batch = dict(
-            observations=self._observations[self.indices],
-            actions=self._actions[self.indices],
+            observations=upcast(self._observations[self.indices]),
+            actions=upcast(self._actions[self.indices]),
             rewards=self._rewards[self.indices],
             terminals=self._terminals[self.indices],
-            next_observations=self._next_obs[self.indices],
+            next_observations=upcast(self._next_obs[self.indices]),
             adj_mats=self._adj_mat[self.indices],
             log_adj_mats=self._log_adj_mat[self.indices],
         )
         if self.joint:
-            batch['opponent_actions'] = self._opponent_actions[self.indices]
+            batch['opponent_actions'] = upcast(self._opponent_actions[self.indices])
+        if self._full_obs is not None:
+            batch['full_obs'] = upcast(self._full_obs[self.indices])
         return batch
 
     def random_batch_by_indices(self, indices):
         batch = dict(
-            observations=self._observations[indices],
-            actions=self._actions[indices],
+            observations=upcast(self._observations[indices]),
+            actions=upcast(self._actions[indices]),
             rewards=self._rewards[indices],
             terminals=self._terminals[indices],
-            next_observations=self._next_obs[indices],
+            next_observations=upcast(self._next_obs[indices]),
             adj_mats=self._adj_mat[indices],
             log_adj_mats=self._log_adj_mat[indices],
         )
         if self.joint:
-            batch['opponent_actions'] = self._opponent_actions[indices]
+            batch['opponent_actions'] = upcast(self._opponent_actions[indices])
+        if self._full_obs is not None:
+            batch['full_obs'] = upcast(self._full_obs[indices])
         return batch
 
     @property
@@ -102,6 +164,10 @@ class SimpleReplayBuffer(ReplayBuffer, Serializable):
 
     def __getstate__(self):
         d = super(SimpleReplayBuffer, self).__getstate__()
+        if self._store is not None:
+            # the data already lives on disk; unpickling reattaches to it
+            self.flush()
+            return d
         d.update(dict(
             o=self._observations.tobytes(),
             a=self._actions.tobytes(),
@@ -115,22 +181,29 @@ class SimpleReplayBuffer(ReplayBuffer, Serializable):
         ))
         if self.joint:
             d.update((dict(o_a=self._opponent_actions.tobytes())))
+        if self._full_obs is not None:
+            d['full_obs'] = self._full_obs.tobytes()
         return d
 
     def __setstate__(self, d):
         super(SimpleReplayBuffer, self).__setstate__(d)
-        self._observations = np.fromstring(d['o']).reshape(
-            self._max_buffer_size, -1
-        )
-        self._next_obs = np.fromstring(d['no']).reshape(
-            self._max_buffer_size, -1
-        )
-        self._actions = np.fromstring(d['a']).reshape(self._max_buffer_size, -1)
-        self._rewards = np.fromstring(d['r']).reshape(self._max_buffer_size)
-        self._terminals = np.fromstring(d['t'], dtype=np.uint8)
-        self._adj_mat = np.fromstring(d['adj'], dtype=np.uint8).reshape(self._max_buffer_size)
-        self._log_adj_mat = np.fromstring(d['log_adj'], dtype=np.uint8).reshape(self._max_buffer_size)
+        if self._store is not None:
+            return
+        # __init__ has been re-run with the saved arguments, so the arrays
+        # already carry the storage dtypes and shapes the bytes were written with.
+        def restore(raw, array):
+            return np.frombuffer(raw, dtype=array.dtype).reshape(array.shape).copy()
+
+        self._observations = restore(d['o'], self._observations)
+        self._next_obs = restore(d['no'], self._next_obs)
+        self._actions = restore(d['a'], self._actions)
+        self._rewards = restore(d['r'], self._rewards)
+        self._terminals = restore(d['t'], self._terminals)
+        self._adj_mat.frombytes(d['adj'])
+        self._log_adj_mat = restore(d['log_adj'], self._log_adj_mat)
         self._top = d['top']
         self._size = d['size']
         if self.joint:
-            self._opponent_actions = np.fromstring(d['o_a']).reshape(self._max_buffer_size, -1)
+            self._opponent_actions = restore(d['o_a'], self._opponent_actions)
+        if self._full_obs is not None:
+            self._full_obs = restore(d['full_obs'], self._full_obs)
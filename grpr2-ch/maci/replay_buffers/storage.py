@@ -0,0 +1,139 @@
+import json
+import os
+
+import numpy as np
+
+
+# Storage dtypes a replay buffer may keep its observations/actions in.
+# Sampled batches are always handed out as float32.
+STORAGE_DTYPES = {
+    'float64': np.float64,
+    'float32': np.float32,
+    'float16': np.float16,
+}
+
+SAMPLE_DTYPE = np.float32
+
+
+def storage_dtype(dtype):
+    """Resolve a storage dtype given by name (`'float16'`) or numpy type."""
+    if isinstance(dtype, str):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError('Unsupported replay storage dtype: {}'.format(dtype))
+        return STORAGE_DTYPES[dtype]
+    return np.dtype(dtype).type
+
+
+def upcast(array):
+    """Return `array` as float32, without copying if it already is."""
+    return array.astype(SAMPLE_DTYPE, copy=False)
+
+
+class AdjacencyStorage(object):
+    """Ring storage for (n, n) adjacency matrices.
+
+    With `packed=True` each matrix is flattened and bit-packed into
+    ceil(n * n / 8) bytes; this is only lossless for 0/1 matrices, which is
+    what `GraphFlows` samples. Otherwise matrices are kept as float32.
+    Indexing always returns float32 arrays of shape (len(indices), n, n).
+
+    If `n_edges` is given, each sample is instead the (n_edges,) edge bit
+    vector of a sparse `GraphFlows` graph, and is packed the same way.
+    """
+
+    def __init__(self, size, n, packed=False, alloc=None, n_edges=None):
+        self.n = n
+        self.packed = packed
+        self.shape = (n, n) if n_edges is None else (n_edges,)
+        self._n_bits = int(np.prod(self.shape))
+        if alloc is None:
+            alloc = lambda name, shape, dtype: np.zeros(shape, dtype=dtype)
+        if packed:
+            self._data = alloc('adj_mat', (size, (self._n_bits + 7) // 8), np.uint8)
+        else:
+            self._data = alloc('adj_mat', (size,) + self.shape, np.float32)
+
+    def __setitem__(self, indices, adj_mats):
+        if self.packed:
+            bits = np.reshape(adj_mats, (-1, self._n_bits)) > 0.5
+            self._data[indices] = np.packbits(bits, axis=-1)
+        else:
+            self._data[indices] = adj_mats
+
+    def __getitem__(self, indices):
+        if self.packed:
+            bits = np.unpackbits(self._data[indices], axis=-1, count=self._n_bits)
+            return bits.reshape((-1,) + self.shape).astype(np.float32)
+        return self._data[indices]
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
+    def tobytes(self):
+        return self._data.tobytes()
+
+    def frombytes(self, raw):
+        self._data = np.frombuffer(raw, dtype=self._data.dtype).reshape(self._data.shape).copy()
+
+
+class MemmapStore(object):
+    """Replay arrays backed by `.npy` memory-mapped files in `directory`.
+
+    Each array is one file opened with `np.lib.format.open_memmap`, so its
+    shape and dtype are recorded on disk. A small JSON header stores the
+    ring pointer (`top`) and `size`. It is only rewritten after the arrays
+    have been flushed, so after a crash it never covers unwritten rows.
+
+    If the header already exists, the files are reopened in place and the
+    buffer resumes from the recorded `top`/`size`; the stored layout must
+    match the one the buffer asks for.
+    """
+
+    HEADER = 'header.json'
+
+    def __init__(self, directory, flush_interval=1000):
+        self.directory = str(directory)
+        self.flush_interval = flush_interval
+        os.makedirs(self.directory, exist_ok=True)
+        self._arrays = []
+        self._since_flush = 0
+        header_path = os.path.join(self.directory, self.HEADER)
+        if os.path.exists(header_path):
+            with open(header_path) as f:
+                header = json.load(f)
+            self.resumed = True
+            self.top = header['top']
+            self.size = header['size']
+        else:
+            self.resumed = False
+            self.top = 0
+            self.size = 0
+
+    def zeros(self, name, shape, dtype):
+        path = os.path.join(self.directory, name + '.npy')
+        shape = tuple(int(d) for d in shape)
+        if self.resumed:
+            array = np.lib.format.open_memmap(path, mode='r+')
+            if array.shape != shape or array.dtype != np.dtype(dtype):
+                raise ValueError('Replay array {} in {} has layout {} {}, expected {} {}'.format(
+                    name, self.directory, array.shape, array.dtype, shape, np.dtype(dtype)))
+        else:
+            array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+        self._arrays.append(array)
+        return array
+
+    def advance(self, n_samples, top, size):
+        self._since_flush += n_samples
+        if self._since_flush >= self.flush_interval:
+            self.flush(top, size)
+
+    def flush(self, top, size):
+        for array in self._arrays:
+            array.flush()
+        header_path = os.path.join(self.directory, self.HEADER)
+        with open(header_path + '.tmp', 'w') as f:
+            json.dump(dict(top=int(top), size=int(size)), f)
+        os.replace(header_path + '.tmp', header_path)
+        self.top, self.size = top, size
+        self._since_flush = 0
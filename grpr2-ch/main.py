@@ -3,15 +3,20 @@ import argparse
 
 import torch
 
-from maci.learners import REGMAAC
-from maci.misc.sampler import GrMASampler
+from maci.learners import REGMAAC, JointTrainer, ParallelTrainer
+from maci.misc.sampler import GrMASampler, GrMAVecSampler
 from maci.environments import make_particle_env
 from maci.misc import logger
+from maci.misc.prefetcher import BatchPrefetcher, make_batch_n
 import gtimer as gt
 import datetime
 from copy import deepcopy
 from maci.get_agents import regma_ac_agent, ddpg_agent
+from maci.replay_buffers import MultiAgentReplayBuffer
 from graph_model import GraphFlows
+from graph_learner import AsyncGraphLearner
+from maci.policies.numpy_policy import NumpyActorEngine
+from maci.misc.noise import GaussianActionNoise, ParameterNoise
 from pathlib import Path
 
 import maci.misc.tf_utils as U
@@ -63,6 +68,37 @@ def parse_args():
     parser.add_argument('-tg', "--train_graph", type=bool, default=False, help="whether the graph reasoning policy should be trained or not")
     parser.add_argument('-pg', "--pretrained_graph", type=bool, default=False, help="whether a pretrained graph reasoning policy should be used or not")
     parser.add_argument("--save_interval", default=1000, type=int)
+    parser.add_argument("--n_envs", default=1, type=int, help="number of environment copies stepped together by the sampler")
+    parser.add_argument("--vec_physics", action="store_true", help="use the array-backed vectorized physics engine")
+    parser.add_argument("--joint_train", action="store_true", help="update all agents with a single fused session run")
+    parser.add_argument("--train_threads", type=int, default=1, help="number of agent updates dispatched concurrently (>1 runs them from a thread pool)")
+    parser.add_argument("--intra_op_threads", type=int, default=1, help="TF intra-op threads")
+    parser.add_argument("--inter_op_threads", type=int, default=None, help="TF inter-op threads (default: --train_threads)")
+    parser.add_argument("--prefetch", type=int, default=0, help="prepare this many training batches ahead on a background thread (0: build them inline)")
+    parser.add_argument("--shared_pool", action="store_true", help="store all agents' transitions in one shared-index replay buffer")
+    parser.add_argument("--replay_dtype", type=str, default="float32", choices=["float64", "float32", "float16"], help="storage dtype of replay observations and actions")
+    parser.add_argument("--pack_adj", action="store_true", help="bit-pack the sampled 0/1 adjacency matrices in the replay buffers")
+    parser.add_argument("--replay_dir", type=str, default=None, help="keep the replay buffers in memory-mapped files under this directory and resume from it if it exists")
+    parser.add_argument("--reuse_graph", action="store_true", help="carry the next-step adjacency over to the following sampler step instead of resampling it")
+    parser.add_argument("--graph_entropy", type=str, default="analytic", choices=["analytic", "mc", "off"], help="entropy estimator of the graph base distribution")
+    parser.add_argument("--trace_graph", action="store_true", help="run the sampler's graph policy through a TorchScript trace of the flow")
+    parser.add_argument("--graph_k", type=int, default=None, help="sparse graph policy over the edges from each agent's k nearest agents")
+    parser.add_argument("--async_graph", action="store_true", help="train the graph policy on a background thread fed through a bounded queue")
+    parser.add_argument("--graph_queue", type=int, default=4, help="pending graph updates before the agent learners block on the graph learner")
+    parser.add_argument("--graph_threads", type=int, default=1, help="torch intra-op threads of the background graph learner")
+    parser.add_argument("--graph_dag", type=str, default="off", choices=["off", "expm", "series"], help="acyclicity penalty on the communication graphs: exact trace-exponential or truncated power series")
+    parser.add_argument("--dag_order", type=int, default=None, help="order of the power-series acyclicity penalty (default: number of agents)")
+    parser.add_argument("--dag_step_interval", type=int, default=100, help="graph updates between augmented-Lagrangian steps of the acyclicity penalty")
+    parser.add_argument("--dag_rho_max", type=float, default=1e6, help="cap on the quadratic coefficient rho of the acyclicity penalty")
+    parser.add_argument("--graph_mask", type=str, default=None, help="sparse graph policy over the edges of a fixed 0/1 (n, n) mask stored as .npy")
+    parser.add_argument("--svgd_kernel", type=str, default="exact", choices=["exact", "fast", "rff"], help="SVGD kernel of the opponent conditional policy: exact, matmul-based, or random Fourier features")
+    parser.add_argument("--kernel_particles", type=int, default=32, help="number of SVGD particles per observation")
+    parser.add_argument("--kernel_median_samples", type=int, default=None, help="estimate the kernel bandwidth from this many random particle pairs (fast/rff kernels)")
+    parser.add_argument("--numpy_actor", type=int, default=0, help="act through NumPy copies of the policies, resynced every this many learner steps (0: act through the TF session)")
+    parser.add_argument("--exploration_noise", type=str, default="ou", choices=["ou", "gaussian", "param"], help="exploration noise of the deterministic policies, one process per environment; param perturbs the weights of the NumPy actors (needs --numpy_actor)")
+    parser.add_argument("--param_noise_sigma", type=float, default=0.1, help="initial scale of the parameter-space noise")
+    parser.add_argument("--xla", action="store_true", help="compile the REGMAAC update ops with XLA JIT")
+    parser.add_argument("--finalize_graph", action="store_true", help="finalize the TF graph after initialization so any later op creation fails fast")
     return parser.parse_args()
 
 
@@ -132,20 +168,29 @@ def main(arglist):
     run_num = 1
     torch.manual_seed(run_num)
     np.random.seed(run_num)
-    env = make_particle_env(arglist.env_id)
+    env = make_particle_env(arglist.env_id, vectorized=arglist.vec_physics)
     
     full_obs_dim = 0
     for obsp in env.observation_space:
         full_obs_dim = full_obs_dim + obsp.shape[0]
     agent_ob_list = [obsp.shape[0] for obsp in env.observation_space]
     
-    GraphFlow_model = GraphFlows(n_s=full_obs_dim, n_agent=agent_num, n_step=arglist.batch_size)
+    GraphFlow_model = GraphFlows(n_s=full_obs_dim, n_agent=agent_num, n_step=arglist.batch_size, entropy_estimator=arglist.graph_entropy,
+                                 trace_act=arglist.trace_graph, k_neighbors=arglist.graph_k,
+                                 edge_mask=None if arglist.graph_mask is None else np.load(arglist.graph_mask),
+                                 dag=None if arglist.graph_dag == 'off' else arglist.graph_dag, dag_order=arglist.dag_order,
+                                 dag_step_interval=arglist.dag_step_interval, dag_rho_max=arglist.dag_rho_max)
     if arglist.env_id == 'simple_spread_local' and arglist.pretrained_graph:
         GraphFlow_model.load(os.path.dirname(os.path.realpath(__file__)) + '/local_graph.pt')
     
     M = arglist.hidden_size
     batch_size = arglist.batch_size
-    sampler = GrMASampler(agent_num=agent_num, joint=True, graph_policy=GraphFlow_model, max_path_length=30, min_pool_size=100, batch_size=batch_size)
+    if arglist.n_envs > 1:
+        sampler = GrMAVecSampler(agent_num=agent_num, joint=True, graph_policy=GraphFlow_model, n_envs=arglist.n_envs, max_path_length=30, min_pool_size=100, batch_size=batch_size,
+                                 reuse_next_graph=arglist.reuse_graph)
+    else:
+        sampler = GrMASampler(agent_num=agent_num, joint=True, graph_policy=GraphFlow_model, max_path_length=30, min_pool_size=100, batch_size=batch_size,
+                              reuse_next_graph=arglist.reuse_graph)
     
 
     base_kwargs = {
@@ -158,8 +203,23 @@ def main(arglist):
     }
 
     agents = []
+    pool_kwargs = {'dtype': arglist.replay_dtype, 'pack_adj_mat': arglist.pack_adj}
+    if GraphFlow_model.sparse:
+        pool_kwargs['n_edges'] = GraphFlow_model.out_size
+    if GraphFlow_model.k_neighbors is not None:
+        # the graph update rebuilds the k-neighbour senders from the raw positions
+        pool_kwargs['full_obs_dim'] = full_obs_dim
+    def replay_dir(name):
+        return None if arglist.replay_dir is None else os.path.join(arglist.replay_dir, name)
+
+    shared_pool = None
+    if arglist.shared_pool:
+        shared_pool = MultiAgentReplayBuffer(env.env_specs, agent_num, max_replay_buffer_size=1e4,
+                                             joint=model_name in ('MADDPG', 'DDPG-OM', 'DDPG-ToM'), directory=replay_dir('shared'),
+                                             **pool_kwargs)
     
-    with U.single_threaded_session():
+    inter_op_threads = arglist.train_threads if arglist.inter_op_threads is None else arglist.inter_op_threads
+    with U.make_session(intra_op_threads=arglist.intra_op_threads, inter_op_threads=inter_op_threads):
         for i in range(agent_num):
             if 'GrPR2AC2' in model_name:
                 k = int(model_name[-1])
@@ -167,7 +227,11 @@ def main(arglist):
                 mu = arglist.mu
                 if 'G' in model_name:
                     g = True
-                agent = regma_ac_agent(model_name, agent_num, i, env, M, u_range, base_kwargs, k=k, g=g, mu=mu, game_name=game_name, aux=arglist.aux)
+                agent = regma_ac_agent(model_name, agent_num, i, env, M, u_range, base_kwargs, k=k, g=g, mu=mu, game_name=game_name, aux=arglist.aux,
+                                       pool=None if shared_pool is None else shared_pool.agent_view(i),
+                                       pool_kwargs=dict(pool_kwargs, directory=replay_dir('agent_{}'.format(i))),
+                                       kernel=arglist.svgd_kernel, kernel_n_particles=arglist.kernel_particles,
+                                       kernel_median_samples=arglist.kernel_median_samples, xla=arglist.xla)
             else:
                 joint = False
                 opponent_modelling = False
@@ -180,14 +244,45 @@ def main(arglist):
                 elif model_name == 'DDPG-OM' or model_name == 'DDPG-ToM':
                     joint = True
                     opponent_modelling = True
-                agent = ddpg_agent(joint, agent_num, opponent_modelling, model_names, i, env, M, u_range, base_kwargs, game_name=game_name)
+                agent = ddpg_agent(joint, agent_num, opponent_modelling, model_names, i, env, M, u_range, base_kwargs, game_name=game_name,
+                                   pool=None if shared_pool is None else shared_pool.agent_view(i),
+                                   pool_kwargs=dict(pool_kwargs, directory=replay_dir('agent_{}'.format(i))))
                 
             agents.append(agent)
             
-        sampler.initialize(env, agents)
+        if arglist.n_envs > 1:
+            sampler.initialize([env] + [make_particle_env(arglist.env_id, vectorized=arglist.vec_physics) for _ in range(arglist.n_envs - 1)], agents, pool=shared_pool)
+        else:
+            sampler.initialize(env, agents, pool=shared_pool)
 
         for agent in agents:
             agent._init_training()
+        team_trainer = None
+        if arglist.joint_train:
+            team_trainer = JointTrainer(agents)
+        elif arglist.train_threads > 1:
+            team_trainer = ParallelTrainer(agents, num_threads=arglist.train_threads)
+        graph_learner = None
+        if arglist.train_graph and arglist.async_graph:
+            graph_learner = AsyncGraphLearner(GraphFlow_model, max_queue=arglist.graph_queue, num_threads=arglist.graph_threads)
+        actor_engine = None
+        if arglist.numpy_actor > 0:
+            actor_engine = NumpyActorEngine([agent.policy for agent in agents], sync_interval=arglist.numpy_actor)
+            sampler.set_actors(actor_engine.actors)
+        if arglist.exploration_noise == 'gaussian':
+            for agent in agents:
+                if hasattr(agent.policy, 'set_noise'):
+                    agent.policy.set_noise(GaussianActionNoise(agent.policy._action_dim, n_envs=arglist.n_envs, sigma=agent.policy.sigma))
+        elif arglist.exploration_noise == 'param':
+            if actor_engine is None:
+                raise ValueError('parameter noise perturbs the NumPy actors, set --numpy_actor')
+            for actor in actor_engine.actors:
+                if hasattr(actor, 'set_parameter_noise'):
+                    actor.set_parameter_noise(ParameterNoise(actor.mlp.param_shapes, n_envs=arglist.n_envs,
+                                                             sigma=arglist.param_noise_sigma))
+        if arglist.finalize_graph:
+            U.finalize_graph()
+        prefetcher = None
         gt.rename_root('MARLAlgorithm')
         gt.reset()
         gt.set_def_unique(False)
@@ -213,6 +308,8 @@ def main(arglist):
                 if not initial_exploration_done:
                     if epoch >= 1000:
                         initial_exploration_done = True
+                if graph_learner is not None and graph_learner.poll():
+                    sampler.invalidate_graph_cache()
                 sampler.sample()
                 # print('Sampling')
                 if not initial_exploration_done:
@@ -251,19 +348,15 @@ def main(arglist):
                         except:
                             pass
 
-                for j in range(base_kwargs['n_train_repeat']):
-                    batch_n = []
-                    recent_batch_n = []
-                    indices = None
-                    receent_indices = None
-                    for i, agent in enumerate(agents):
-                        if i == 0:
-                            batch = agent.pool.random_batch(batch_size)
-                            indices = agent.pool.indices
-                            receent_indices = list(range(agent.pool._top-batch_size, agent.pool._top))
+                if prefetcher is None and arglist.prefetch > 0:
+                    prefetcher = BatchPrefetcher(agents, batch_size, shared_pool=shared_pool, depth=arglist.prefetch)
+                    sampler.set_pool_lock(prefetcher.lock)
 
-                        batch_n.append(agent.pool.random_batch_by_indices(indices))
-                        recent_batch_n.append(agent.pool.random_batch_by_indices(receent_indices))
+                for j in range(base_kwargs['n_train_repeat']):
+                    if prefetcher is not None:
+                        batch_n, graph_batch = prefetcher.get()
+                    else:
+                        batch_n, graph_batch = make_batch_n(agents, batch_size, shared_pool=shared_pool)
 
                     # print(len(batch_n))
                     target_next_actions_n = []
@@ -273,28 +366,17 @@ def main(arglist):
                     except:
                         pass
 
-                    all_obs = np.array(np.concatenate([batch['observations'] for batch in batch_n], axis=-1))
-                    all_next_obs = np.array(np.concatenate([batch['next_observations'] for batch in batch_n], axis=-1))
-                    all_matrix_As = np.array(np.concatenate([batch['adj_mats'] for batch in batch_n], axis=-1))
-                    all_log_As_probs = np.array(np.concatenate([batch['log_adj_mats'] for batch in batch_n], axis=-1))
-                    
-                    opponent_actions_n = np.array([batch['actions'] for batch in batch_n])
-                    recent_opponent_actions_n = np.array([batch['actions'] for batch in recent_batch_n])
-
-                    ####### figure out
-                    recent_opponent_observations_n = []
-                    for batch in recent_batch_n:
-                        recent_opponent_observations_n.append(batch['observations'])
-
-
-                    current_actions = [agents[i]._policy.get_actions(batch_n[i]['next_observations'])[0][0] for i in range(agent_num)]
+                    current_actions = []
                     all_actions_k = []
                     for i, agent in enumerate(agents):
-                        if isinstance(agent, REGMAAC):
-                            if agent._k > 0:
-                                batch_actions_k = agent._policy.get_all_actions(batch_n[i]['next_observations'])
-                                actions_k = [a[0][0] for a in batch_actions_k]
-                                all_actions_k.append(';'.join(list(map(str, actions_k))))
+                        if isinstance(agent, REGMAAC) and agent._k > 0:
+                            # the level chain is evaluated once for both logs
+                            actions, batch_actions_k = agent._policy.get_actions_and_levels(batch_n[i]['next_observations'])
+                            actions_k = [a[0][0] for a in batch_actions_k]
+                            all_actions_k.append(';'.join(list(map(str, actions_k))))
+                        else:
+                            actions = agent._policy.get_actions(batch_n[i]['next_observations'])
+                        current_actions.append(actions[0][0])
                     if len(all_actions_k) > 0:
                         with open('{}/all_actions.csv'.format(policy_dir), 'a') as f:
                             f.write(','.join(list(map(str, all_actions_k))) + '\n')
@@ -307,14 +389,13 @@ def main(arglist):
                             batch_n[i]['next_actions'] = deepcopy(target_next_actions_n[i])
                         except:
                             pass
-                        batch_n[i]['opponent_actions'] = np.reshape(np.delete(deepcopy(opponent_actions_n), i, 0), (-1, agent._opponent_action_dim))
                         if agent.joint:
                             if agent.opponent_modelling:
-                                batch_n[i]['recent_opponent_observations'] = recent_opponent_observations_n[i]
-                                batch_n[i]['recent_opponent_actions'] = np.reshape(np.delete(deepcopy(recent_opponent_actions_n), i, 0), (-1, agent._opponent_action_dim))
                                 batch_n[i]['opponent_next_actions'] = agent.opponent_policy.get_actions(batch_n[i]['next_observations'])
                             else:
-                                batch_n[i]['opponent_next_actions'] = np.reshape(np.delete(deepcopy(target_next_actions_n), i, 0), (-1, agent._opponent_action_dim))
+                                batch_n[i]['opponent_next_actions'] = np.concatenate(target_next_actions_n[:i] + target_next_actions_n[i + 1:], axis=-1)
+                        if team_trainer is not None:
+                            continue
                         if isinstance(agent, REGMAAC):
                             agent._do_training(iteration=t + epoch * agent._epoch_length, batch=batch_n[i], annealing=alpha)
                         else:
@@ -325,15 +406,33 @@ def main(arglist):
                             q_mean_agent = agent.ret_q_mean(batch=batch_n[i])
                             Q_mean += q_mean_agent
                     
+                    if team_trainer is not None:
+                        q_means = team_trainer.do_training(iteration=t + epoch * agents[0]._epoch_length, batch_n=batch_n, annealing=alpha,
+                                                            q_mean=arglist.train_graph and epoch < 1000)
+                        if q_means is not None:
+                            Q_mean = np.sum(q_means)
+
                     if arglist.train_graph and epoch < 1000:
                         Q_mean = np.array(Q_mean / agent_num)
-                        graph_loss = sampler.graph_policy.backward(obs=all_obs , qs=Q_mean, As=all_matrix_As, log_As_probs=all_log_As_probs)
+                        if graph_learner is not None:
+                            graph_learner.submit(qs=Q_mean, **graph_batch)
+                        else:
+                            graph_loss = sampler.graph_policy.backward(qs=Q_mean, **graph_batch)
+                            sampler.invalidate_graph_cache()
+
+                    if actor_engine is not None and actor_engine.step() and arglist.exploration_noise == 'param':
+                        for actor, batch in zip(actor_engine.actors, batch_n):
+                            if getattr(actor, 'parameter_noise', None) is not None:
+                                actor.adapt_parameter_noise(batch['observations'])
 
                 gt.stamp('train')
                 
             if epoch % arglist.save_interval == 0:
                 os.makedirs(run_dir / 'incremental', exist_ok=True)
                 GraphFlow_model.save(run_dir / 'graph.pt')
+                if arglist.replay_dir is not None:
+                    for pool in [shared_pool] if shared_pool is not None else [agent.pool for agent in agents]:
+                        pool.flush()
 
             # self._evaluate(epoch)
 
@@ -356,6 +455,14 @@ def main(arglist):
             logger.pop_prefix()
             sampler.terminate()
 
+        if prefetcher is not None:
+            prefetcher.close()
+        if hasattr(team_trainer, 'close'):
+            team_trainer.close()
+        if graph_learner is not None:
+            graph_learner.close()
+            GraphFlow_model.save(run_dir / 'graph.pt')
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,24 @@
+import torch
+
+from acyclicity import AcyclicityConstraint
+
+
+def _run(constraint, costs):
+    for cost in costs:
+        x = torch.tensor(cost, requires_grad=True)
+        constraint(x).backward()
+        constraint.step()
+
+
+def test_rho_capped_when_violation_stalls(capsys):
+    constraint = AcyclicityConstraint(step_interval=2, rho_max=8.)
+    _run(constraint, [1.] * 40)
+    assert constraint.lagrangian.rho.item() == 8.
+    assert capsys.readouterr().out == ''
+
+
+def test_rho_kept_while_violation_drops():
+    constraint = AcyclicityConstraint(step_interval=2, rho=1.)
+    _run(constraint, [0.1 ** (i // 2) for i in range(20)])
+    assert constraint.lagrangian.rho.item() == 1.
+    assert constraint.lagrangian.lam.item() > 1.
@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+pytest.importorskip('rllab')
+
+from maci.learners.joint_trainer import JointTrainer
+from maci.learners.parallel_trainer import ParallelTrainer
+from maci.misc import tf_utils
+
+
+class _Agent(object):
+    """The parts of a learner `JointTrainer` uses: one source variable
+    trained by gradient descent towards `x`, and its target copy."""
+
+    def __init__(self, agent_id, tau, lr):
+        self._agent_id = agent_id
+        self._tau = tau
+        self._train_qf = True
+        self._qf_target_update_interval = 1
+        self._x = tf.compat.v1.placeholder(tf.float32, [], name='x_{}'.format(agent_id))
+        self.source = tf.compat.v1.Variable(1., name='source_{}'.format(agent_id))
+        self.target = tf.compat.v1.Variable(-1., name='target_{}'.format(agent_id))
+        loss = 0.5 * (self.source - self._x) ** 2
+        self._training_ops = [tf.compat.v1.train.GradientDescentOptimizer(lr).minimize(loss)]
+        self._target_params = [self.target]
+        self._source_params = [self.source]
+        self._target_ops = [tf_utils.polyak_update(self._target_params, self._source_params, tau)]
+        self._q_mean = tf.identity(loss)
+        self._sess = tf.compat.v1.get_default_session()
+
+    def _get_feed_dict(self, batch):
+        return {self._x: batch}
+
+    def ret_q_mean(self, batch):
+        return self._sess.run(self._q_mean, self._get_feed_dict(batch))
+
+
+def _ancestors(op):
+    seen, stack = set(), [op]
+    while stack:
+        op = stack.pop()
+        for parent in [tensor.op for tensor in op.inputs] + list(op.control_inputs):
+            if parent not in seen:
+                seen.add(parent)
+                stack.append(parent)
+    return seen
+
+
+def test_target_update_depends_on_training():
+    # The fused run may schedule the ops in any order, so the ordering must
+    # be in the graph: every read of a source variable by a target update
+    # comes after the joint training op.
+    with tf.Graph().as_default():
+        agents = [_Agent(i, 0.1, 0.5) for i in range(2)]
+        with tf.compat.v1.Session() as sess, sess.as_default():
+            trainer = JointTrainer(agents)
+        train_op = trainer._train_op
+        before_training = _ancestors(train_op) | {train_op}
+        for agent, target_op in zip(agents, trainer._target_ops):
+            source = agent.source.op.outputs[0]
+            source_reads = [op for op in _ancestors(target_op)
+                            if source in op.inputs and op not in before_training]
+            assert len(source_reads) > 0
+            for op in source_reads:
+                assert train_op in _ancestors(op), op.name
+
+
+def test_target_update_reads_trained_source():
+    tau, lr = 0.1, 0.5
+    with tf.Graph().as_default():
+        agents = [_Agent(i, tau, lr) for i in range(2)]
+        with tf.compat.v1.Session() as sess, sess.as_default():
+            trainer = JointTrainer(agents)
+            sess.run(tf.compat.v1.global_variables_initializer())
+            old_source, old_target = sess.run([agents[0].source, agents[0].target])
+
+            batch = 3.
+            trainer.do_training(iteration=0, batch_n=[batch, batch])
+
+            new_source = old_source - lr * (old_source - batch)
+            for agent in agents:
+                source, target = sess.run([agent.source, agent.target])
+                np.testing.assert_allclose(source, new_source, rtol=1e-6)
+                np.testing.assert_allclose(target, (1 - tau) * old_target + tau * new_source, rtol=1e-6)
+
+
+@pytest.mark.parametrize('trainer_cls', [JointTrainer, ParallelTrainer])
+def test_q_mean_matches_ret_q_mean(trainer_cls):
+    with tf.Graph().as_default():
+        with tf.compat.v1.Session() as sess, sess.as_default():
+            agents = [_Agent(i, 0.1, 0.5) for i in range(2)]
+            trainer = trainer_cls(agents)
+            sess.run(tf.compat.v1.global_variables_initializer())
+
+            batch_n = [3., -2.]
+            before = [agent.ret_q_mean(batch) for agent, batch in zip(agents, batch_n)]
+            q_means = trainer.do_training(iteration=0, batch_n=batch_n, q_mean=True)
+            after = [agent.ret_q_mean(batch) for agent, batch in zip(agents, batch_n)]
+            if hasattr(trainer, 'close'):
+                trainer.close()
+
+    # the diagnostic is taken on the trained agents, as in the per-agent loop
+    np.testing.assert_allclose(q_means, after, rtol=1e-6)
+    assert not np.allclose(q_means, before)
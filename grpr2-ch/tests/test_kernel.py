@@ -0,0 +1,66 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.ops.numpy_ops import np_config
+
+from maci.misc.kernel import (adaptive_isotropic_gaussian_kernel, fast_isotropic_gaussian_kernel,
+                              rff_isotropic_gaussian_kernel, stein_variational_gradient)
+
+
+# as in training, where importing the samplers turns on NumPy type promotion
+np_config.enable_numpy_behavior()
+
+N, KX, KY, D = 3, 16, 9, 4
+
+
+def _particles(seed=0):
+    rng = np.random.RandomState(seed)
+    xs = tf.constant(rng.randn(N, KX, D).astype(np.float32))
+    ys = tf.constant(rng.randn(N, KY, D).astype(np.float32))
+    grad_log_p = tf.constant(rng.randn(N, KX, D).astype(np.float32))
+    return xs, ys, grad_log_p
+
+
+def _baseline_direction(kernel_dict, grad_log_p):
+    # the SVGD direction as computed from the full kernel gradient
+    driving = tf.reduce_mean(kernel_dict['output'][..., None] * grad_log_p[:, :, None, :], axis=1)
+    return driving + tf.reduce_mean(kernel_dict['gradient'], axis=1)
+
+
+def test_fast_kernel_matches_exact():
+    xs, ys, grad_log_p = _particles()
+    exact = adaptive_isotropic_gaussian_kernel(xs, ys)
+    fast = fast_isotropic_gaussian_kernel(xs, ys)
+    assert exact['output'].dtype == fast['output'].dtype == fast['mean_gradient'].dtype == tf.float32
+
+    np.testing.assert_allclose(fast['output'], exact['output'], rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(fast['gradient'], exact['gradient'], rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(fast['mean_gradient'], tf.reduce_mean(exact['gradient'], axis=1),
+                               rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(stein_variational_gradient(fast, grad_log_p),
+                               _baseline_direction(exact, grad_log_p), rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(stein_variational_gradient(exact, grad_log_p),
+                               _baseline_direction(exact, grad_log_p), rtol=1e-4, atol=1e-5)
+
+
+def test_sampled_median_covering_all_pairs_is_exact():
+    xs, ys, _ = _particles()
+    exact = adaptive_isotropic_gaussian_kernel(xs, ys)
+    fast = fast_isotropic_gaussian_kernel(xs, ys, median_samples=KX * KY)
+    np.testing.assert_allclose(fast['output'], exact['output'], rtol=1e-4, atol=1e-6)
+
+
+def test_rff_kernel_approximates_exact():
+    tf.random.set_seed(0)
+    xs, ys, grad_log_p = _particles()
+    exact = adaptive_isotropic_gaussian_kernel(xs, ys)
+    # the bandwidth from all pairs, so only the features approximate
+    rff = rff_isotropic_gaussian_kernel(xs, ys, n_features=20000, median_samples=None)
+    assert rff['output'].dtype == rff['mean_gradient'].dtype == tf.float32
+
+    np.testing.assert_allclose(rff['output'], exact['output'], atol=0.03)
+    direction = _baseline_direction(exact, grad_log_p)
+    np.testing.assert_allclose(stein_variational_gradient(rff, grad_log_p), direction,
+                               atol=0.06 * np.abs(direction).max())
+    # the reduced terms are those of the full feature-kernel gradient
+    np.testing.assert_allclose(stein_variational_gradient(rff, grad_log_p), _baseline_direction(rff, grad_log_p),
+                               rtol=1e-3, atol=1e-4)
@@ -0,0 +1,31 @@
+import numpy as np
+
+from maci.misc.noise import GaussianActionNoise, OUActionNoise
+
+
+def test_stationary_draws_leave_env_processes():
+    noise = OUActionNoise(3, n_envs=1)
+    noise.sample_envs()
+    state = noise.state.copy()
+    # a one-row batch is not an environment step, even with n_envs == 1
+    for _ in range(10):
+        assert noise.sample_stationary(1).shape == (1, 3)
+    assert noise.sample_stationary(4).shape == (4, 3)
+    np.testing.assert_array_equal(noise.state, state)
+
+
+def test_env_draws_advance_each_process():
+    np.random.seed(0)
+    noise = OUActionNoise(2, n_envs=3, theta=0.5, sigma=0.2)
+    first = noise.sample_envs()
+    second = noise.sample_envs()
+    assert first.shape == second.shape == (3, 2)
+    np.testing.assert_array_equal(noise.state, second)
+    noise.reset([1])
+    np.testing.assert_array_equal(noise.state[1], 0.)
+    np.testing.assert_array_equal(noise.state[[0, 2]], second[[0, 2]])
+
+
+def test_gaussian_env_draws_are_stored():
+    noise = GaussianActionNoise(2, n_envs=4)
+    np.testing.assert_array_equal(noise.sample_envs(), noise.state)
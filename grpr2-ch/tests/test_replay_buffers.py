@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip('rllab')
+
+from maci.misc.prefetcher import make_batch_n
+from maci.replay_buffers import MultiAgentReplayBuffer
+
+
+def _spec(obs_dims, action_dims):
+    space = lambda dims: [SimpleNamespace(flat_dim=dim) for dim in dims]
+    return SimpleNamespace(observation_space=space(obs_dims), action_space=space(action_dims))
+
+
+def _add(pool, rng, n_agents=2, obs_dim=3, action_dim=2, full_obs=None):
+    sample = dict(observation_n=[rng.randn(obs_dim) for _ in range(n_agents)],
+                  action_n=[rng.rand(action_dim) for _ in range(n_agents)],
+                  reward_n=rng.randn(n_agents), terminal_n=np.zeros(n_agents),
+                  next_observation_n=[rng.randn(obs_dim) for _ in range(n_agents)],
+                  adj_mat=rng.rand(n_agents, n_agents) > 0.5, log_adj_mat=rng.randn(),
+                  full_obs=full_obs)
+    pool.add_sample(**sample)
+    return sample
+
+
+def test_full_obs_stored_only_on_request():
+    rng = np.random.RandomState(0)
+    pool = MultiAgentReplayBuffer(_spec([3, 3], [2, 2]), 2, 10)
+    _add(pool, rng, full_obs=rng.randn(4))
+    assert pool._full_obs is None
+    assert all('full_obs' not in batch for batch in pool.batch_n_by_indices([0]))
+
+    pool = MultiAgentReplayBuffer(_spec([3, 3], [2, 2]), 2, 10, full_obs_dim=4)
+    full_obs = rng.randn(4)
+    _add(pool, rng, full_obs=full_obs)
+    for batch in pool.batch_n_by_indices([0]):
+        np.testing.assert_allclose(batch['full_obs'][0], full_obs, rtol=1e-6)
+
+
+def test_replayed_sparse_graph_matches_sampled_graph():
+    torch = pytest.importorskip('torch')
+    from graph_model import GraphFlows
+
+    n_agents, obs_dim, n_samples = 4, 3, 6
+    torch.manual_seed(0)
+    flows = GraphFlows(n_s=n_agents * obs_dim, n_agent=n_agents, n_step=8, k_neighbors=2, dag='expm')
+    rng = np.random.RandomState(0)
+    full_obs = rng.randn(n_samples, n_agents * obs_dim).astype(np.float32)
+    hidden_state = full_obs.reshape(n_samples, n_agents, obs_dim)
+    edges, _, _ = flows.act(full_obs, hidden_state)
+
+    pool = MultiAgentReplayBuffer(_spec([obs_dim] * n_agents, [2] * n_agents), n_agents, n_samples,
+                                  full_obs_dim=n_agents * obs_dim, pack_adj_mat=True, n_edges=flows.out_size)
+    for i in range(n_samples):
+        pool.add_sample(observation_n=list(hidden_state[i]),
+                        action_n=[rng.rand(2) for _ in range(n_agents)],
+                        reward_n=rng.randn(n_agents), terminal_n=np.zeros(n_agents),
+                        next_observation_n=[rng.randn(obs_dim) for _ in range(n_agents)],
+                        adj_mat=edges[i], log_adj_mat=rng.randn(), full_obs=full_obs[i])
+    agents = [SimpleNamespace(joint=False, opponent_modelling=False)] * n_agents
+    _, graph_batch = make_batch_n(agents, n_samples, shared_pool=pool, rng=np.random.RandomState(1))
+
+    indices = [np.flatnonzero((full_obs == row).all(axis=1))[0] for row in graph_batch['full_obs']]
+    expected = flows.dense_adjacency(full_obs[indices], edges[indices]).numpy()
+    replayed = flows.dense_adjacency(graph_batch['full_obs'], graph_batch['As']).numpy()
+    np.testing.assert_array_equal(replayed, expected)
+
+
+def test_memmap_packed_buffer_resumes(tmp_path):
+    rng = np.random.RandomState(0)
+    kwargs = dict(full_obs_dim=4, dtype='float16', pack_adj_mat=True, directory=tmp_path / 'replay')
+    pool = MultiAgentReplayBuffer(_spec([3, 3], [2, 2]), 2, 10, **kwargs)
+    # wrap around the ring once
+    samples = [_add(pool, rng, full_obs=rng.randn(4)) for _ in range(13)]
+    pool.flush()
+    del pool
+
+    resumed = MultiAgentReplayBuffer(_spec([3, 3], [2, 2]), 2, 10, **kwargs)
+    assert (resumed._top, resumed.size) == (3, 10)
+    batch_n = resumed.batch_n_by_indices(np.arange(10))
+    half = lambda x: np.asarray(x, dtype=np.float16).astype(np.float32)
+    for row in range(10):
+        sample = samples[row + 10 if row < 3 else row]
+        for i, batch in enumerate(batch_n):
+            np.testing.assert_array_equal(batch['observations'][row], half(sample['observation_n'][i]))
+            np.testing.assert_array_equal(batch['actions'][row], half(sample['action_n'][i]))
+            np.testing.assert_array_equal(batch['next_observations'][row], half(sample['next_observation_n'][i]))
+            np.testing.assert_allclose(batch['rewards'][row], sample['reward_n'][i], rtol=1e-6)
+        np.testing.assert_array_equal(batch_n[0]['adj_mats'][row], sample['adj_mat'])
+        np.testing.assert_allclose(batch_n[0]['log_adj_mats'][row, 0], sample['log_adj_mat'], rtol=1e-6)
+        np.testing.assert_array_equal(batch_n[0]['full_obs'][row], half(sample['full_obs']))
+
+    # resuming with another layout is refused
+    with pytest.raises(ValueError):
+        MultiAgentReplayBuffer(_spec([3, 3], [2, 2]), 2, 10, **dict(kwargs, dtype='float32'))